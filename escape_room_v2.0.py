@@ -1,12 +1,26 @@
 import pygame
 import sys
 import os
-
-pygame.init()
+import time
+import argparse
+import asyncio
+import json
+import math
+import mmap
+import queue
+import signal
+import statistics
+import struct
+import itertools
+import tracemalloc
+import zlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 try:
-    pygame.mixer.init()
-except Exception:
-    pass
+    import numpy  # optional, only for room lighting
+except ImportError:
+    numpy = None
 
 # ---------------- Global Variables ----------------
 WINDOW_WIDTH = 1024
@@ -34,16 +48,9 @@ BG1_PATH = os.path.join(TEXTURES_DIR, "bg.png")
 BG2_PATH = os.path.join(TEXTURES_DIR, "bg2.png")
 BG3_PATH = os.path.join(TEXTURES_DIR, "bg3.png")
 FRAG_IMAGE_PATH = os.path.join(TEXTURES_DIR, "vase_fragment.png")
+BUNDLE_PATH = os.path.join(TEXTURES_DIR, "assets.bundle")
 
 
-# Load music
-try:
-    pygame.mixer.music.load(THEME_MUSIC_PATH)
-    pygame.mixer.music.set_volume(0.5)
-    pygame.mixer.music.play(-1)
-except Exception:
-    pass
-
 # Load textures safely
 def load_texture(path):
     try:
@@ -52,30 +59,510 @@ def load_texture(path):
         print(f"Failed to load texture {path}: {e}")
         return None
 
-CHEST_IMAGE = load_texture(CHEST_IMAGE_PATH)
-BUTTON_IMAGE = load_texture(BUTTON_IMAGE_PATH)
-DOOR_IMAGE = load_texture(DOOR_IMAGE_PATH)
-KEYPAD_EXTRA_IMAGE = load_texture(KEYPAD_EXTRA_PATH)
-KEYPAD_DISPLAY_IMAGE = load_texture(KEYPAD_DISPLAY_PATH)
-KEY_IMAGE = load_texture(KEY_IMAGE_PATH)
-DOOR_OPEN_IMAGE = load_texture(DOOR_OPEN_IMAGE_PATH)
-SLOT_IMAGE = load_texture(SLOT_IMAGE_PATH)
-ROPE_IMAGE = load_texture(ROPE_IMAGE_PATH)
-FRAGMENT_IMAGE = load_texture(FRAG_IMAGE_PATH)
-
-# Load backgrounds
-BG1 = pygame.image.load(BG1_PATH)
-BG1 = pygame.transform.scale(BG1, (WINDOW_WIDTH, WINDOW_HEIGHT))
-BG2 = pygame.image.load(BG2_PATH)
-BG2 = pygame.transform.scale(BG2, (WINDOW_WIDTH, WINDOW_HEIGHT))
-BG3 = pygame.image.load(BG3_PATH)
-BG3 = pygame.transform.scale(BG3, (WINDOW_WIDTH, WINDOW_HEIGHT))
-
-# Load open sound
-try:
-    OPEN_SOUND = pygame.mixer.Sound(OPEN_SOUND_PATH)
-except Exception:
-    OPEN_SOUND = None
+# ---------------- Asset Manager ----------------
+# Nothing is loaded at import. The current room's textures are loaded first
+# on a worker thread (the game shows a loading screen meanwhile), then its
+# neighbours are preloaded; rooms that can't be reached next are evicted.
+# With a memory budget (bytes for textures plus their scaled copies), going
+# over it first evicts textures the current room doesn't need, largest first,
+# then leaves the scaled-surface cache only what the textures leave over. The
+# current room and the shared icons always stay.
+ASSET_BUDGET = None
+ASSET_PATHS = {
+    "chest": CHEST_IMAGE_PATH,
+    "button": BUTTON_IMAGE_PATH,
+    "door": DOOR_IMAGE_PATH,
+    "door_open": DOOR_OPEN_IMAGE_PATH,
+    "keypad_extra": KEYPAD_EXTRA_PATH,
+    "keypad_display": KEYPAD_DISPLAY_PATH,
+    "key": KEY_IMAGE_PATH,
+    "slot": SLOT_IMAGE_PATH,
+    "rope": ROPE_IMAGE_PATH,
+    "fragment": FRAG_IMAGE_PATH,
+    "bg1": BG1_PATH,
+    "bg2": BG2_PATH,
+    "bg3": BG3_PATH,
+}
+
+# Assets scaled once at load time, to the largest size they are drawn at
+ASSET_SIZES = {
+    "bg1": (WINDOW_WIDTH, WINDOW_HEIGHT),
+    "bg2": (WINDOW_WIDTH, WINDOW_HEIGHT),
+    "bg3": (WINDOW_WIDTH, WINDOW_HEIGHT),
+    "door": (400, 400),
+    "door_open": (400, 400),
+    "chest": (150, 150),
+    "rope": (64, 500),
+    "slot": (64, 64),
+    "button": (40, 40),
+    "keypad_display": (140, 40),
+    "fragment": (54, 54),
+}
+
+# Fully opaque assets get the faster non-alpha display format
+OPAQUE_ASSETS = ("bg1", "bg2", "bg3")
+
+# Inventory icons can show up in any room
+SHARED_ASSETS = ("slot", "key", "fragment")
+
+def surface_bytes(surf):
+    return surf.get_pitch() * surf.get_height()
+
+# Which textures each room needs, and which rooms the player can walk into
+# next (those stay resident), both come from the scene file
+class AssetManager:
+    def __init__(self, paths=ASSET_PATHS, sizes=ASSET_SIZES, room_assets=None,
+                 neighbours=None, shared=SHARED_ASSETS, budget=ASSET_BUDGET):
+        self.paths = paths
+        self.sizes = sizes
+        self.budget = budget
+        self.budget_evictions = 0
+        self.room_assets = room_assets or {}
+        self.neighbours = neighbours or {}
+        self.shared = shared
+        self.current_room = None
+        self.bundle = None
+        self.bundle_path = BUNDLE_PATH
+
+        # only touched on the main thread
+        self.surfaces = {}
+        self.generation = 0     # bumped whenever a surface is added or dropped
+        self.failed = set()
+        self.load_times = {}
+        self.sources = {}
+
+        # name -> priority, from enqueue until the result is stored; shared
+        # with the worker, so only touched under the lock
+        self.lock = threading.Lock()
+        self.queued = {}
+        self.loading = set()
+        self.requests = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.seq = itertools.count()
+        self.worker = None
+
+    def use_scene(self, scene):
+        self.room_assets = scene.room_assets()
+        self.neighbours = scene.neighbours()
+
+    def use_render_size(self, size):
+        # before start(): textures with a target size load at the render
+        # resolution, from that resolution's own bundle
+        self.sizes = render_asset_sizes(size)
+        self.bundle_path = bundle_path(size)
+
+    def open_bundle(self, path=None):
+        self.bundle = AssetBundle(path or self.bundle_path)
+
+    def start(self):
+        if self.bundle is None:
+            self.open_bundle()
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work, name="asset-loader", daemon=True)
+            self.worker.start()
+
+    def load(self, name):
+        start = time.perf_counter()
+        path = self.paths[name]
+        if self.bundle is not None and self.bundle.fresh(name, path, self.sizes.get(name)):
+            surf = self.bundle.load(name)
+            source = "bundle"
+        else:
+            surf = load_texture(path)
+            if surf is not None and name in self.sizes:
+                surf = pygame.transform.scale(surf, self.sizes[name])
+            source = "png"
+        return surf, (time.perf_counter() - start) * 1000.0, source
+
+    def work(self):
+        while True:
+            _, _, name = self.requests.get()
+            # a name re-queued at a higher priority is only loaded once
+            with self.lock:
+                if name not in self.queued or name in self.loading:
+                    continue
+                self.loading.add(name)
+            try:
+                result = self.load(name)
+            except Exception as e:
+                # stored as a failed load; the thread has to keep serving the rest
+                print(f"Failed to load {name}: {e}")
+                result = (None, 0.0, "error")
+            self.results.put((name,) + result)
+
+    def enqueue(self, names, priority):
+        with self.lock:
+            for name in names:
+                if name in self.surfaces or name in self.failed:
+                    continue
+                old = self.queued.get(name)
+                if old is not None and old <= priority:
+                    continue
+                self.queued[name] = priority
+                self.requests.put((priority, next(self.seq), name))
+
+    def busy(self):
+        with self.lock:
+            return bool(self.queued)
+
+    def pump(self, limit=None):
+        # Publish finished loads; call from the main thread once per frame
+        count = 0
+        while limit is None or count < limit:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return count
+            self.store(*result)
+            count += 1
+        return count
+
+    def store(self, name, surf, ms, source):
+        self.load_times[name] = ms
+        self.sources[name] = source
+        with self.lock:
+            if surf is None:
+                self.failed.add(name)
+            else:
+                self.surfaces[name] = self.to_display_format(name, surf)
+                self.generation += 1
+            self.queued.pop(name, None)
+            self.loading.discard(name)
+        if surf is not None:
+            self.enforce_budget()
+
+    def to_display_format(self, name, surf):
+        # Needs a display mode, so only ever called on the main thread
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            try:
+                return surf.convert() if name in OPAQUE_ASSETS else surf.convert_alpha()
+            except pygame.error:
+                pass
+        return surf
+
+    def resident_names(self):
+        names = set(self.shared)
+        for room in (self.current_room,) + tuple(self.neighbours.get(self.current_room, ())):
+            names.update(self.room_assets.get(room, ()))
+        return names
+
+    def enter_room(self, room):
+        self.current_room = room
+        self.enqueue(self.shared + self.room_assets.get(room, ()), 0)
+        for other in self.neighbours.get(room, ()):
+            self.enqueue(self.room_assets.get(other, ()), 1)
+        self.evict()
+        self.enforce_budget()
+
+    def drop(self, name):
+        SCALE_CACHE.discard_source(self.surfaces.pop(name))
+        self.generation += 1
+
+    def evict(self):
+        keep = self.resident_names()
+        for name in [n for n in self.surfaces if n not in keep]:
+            self.drop(name)
+
+    def resident_bytes(self):
+        return sum(surface_bytes(surf) for surf in self.surfaces.values())
+
+    def enforce_budget(self):
+        if self.budget is None:
+            return
+        needed = set(self.shared).union(self.room_assets.get(self.current_room, ()))
+        spare = sorted((n for n in self.surfaces if n not in needed),
+                       key=lambda n: surface_bytes(self.surfaces[n]), reverse=True)
+        for name in spare:
+            if self.resident_bytes() + SCALE_CACHE.bytes_used <= self.budget:
+                break
+            self.drop(name)
+            self.budget_evictions += 1
+        SCALE_CACHE.max_bytes = min(SCALE_CACHE_MAX_BYTES, max(0, self.budget - self.resident_bytes()))
+        SCALE_CACHE.evict()
+
+    def load_now(self, names):
+        # Blocking load on the calling thread (tools and reports)
+        for name in names:
+            if name not in self.surfaces and name not in self.failed:
+                self.store(name, *self.load(name))
+
+    def room_ready(self, room):
+        names = self.shared + self.room_assets.get(room, ())
+        return all(n in self.surfaces or n in self.failed for n in names)
+
+    def progress(self, room):
+        names = self.shared + self.room_assets.get(room, ())
+        done = sum(1 for n in names if n in self.surfaces or n in self.failed)
+        return done, len(names)
+
+    def get(self, name):
+        return self.surfaces.get(name)
+
+    def report(self):
+        lines = []
+        for name, ms in sorted(self.load_times.items(), key=lambda kv: -kv[1]):
+            state = "failed" if name in self.failed else ("resident" if name in self.surfaces else "evicted")
+            lines.append(f"{name:16s} {ms:8.2f} ms  {self.sources.get(name, ''):6s} {state}")
+        lines.append(f"{'total':16s} {sum(self.load_times.values()):8.2f} ms")
+        return "\n".join(lines)
+
+ASSETS = AssetManager()
+
+# ---------------- Asset Bundle ----------------
+# `--bake` writes every texture, already scaled to its target size, as raw
+# RGBA into one file: a header, a JSON index, then the pixel data. At runtime
+# the file is memory-mapped and surfaces are built straight from it. Entries
+# whose source PNG changed since the bake, or whose pixels a truncated file
+# no longer holds, are ignored, so a stale, damaged or missing bundle just
+# means falling back to the PNGs.
+BUNDLE_MAGIC = b"DWAB"
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct("<4sHI")  # magic, version, index length
+
+def surface_to_bytes(surf, fmt):
+    # pygame 2.3 renamed image.tostring to image.tobytes
+    tobytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring
+    return tobytes(surf, fmt)
+
+def bake_assets(path=BUNDLE_PATH, sizes=ASSET_SIZES):
+    index = {}
+    blobs = []
+    offset = 0
+    for name, source in sorted(ASSET_PATHS.items()):
+        surf = load_texture(source)
+        if surf is None:
+            continue
+        if name in sizes:
+            surf = pygame.transform.scale(surf, sizes[name])
+        data = surface_to_bytes(surf, "RGBA")
+        st = os.stat(source)
+        index[name] = {"offset": offset, "size": list(surf.get_size()),
+                       "mtime": st.st_mtime_ns, "bytes": st.st_size}
+        blobs.append(data)
+        offset += len(data)
+
+    meta = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(meta)))
+        f.write(meta)
+        for data in blobs:
+            f.write(data)
+    os.replace(tmp_path, path)
+    return index
+
+class AssetBundle:
+    def __init__(self, path=BUNDLE_PATH):
+        self.path = path
+        self.index = {}
+        self.data_start = 0
+        self.mm = None
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, meta_len = BUNDLE_HEADER.unpack_from(mm, 0)
+            if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+                mm.close()
+                return
+            start = BUNDLE_HEADER.size
+            index = json.loads(mm[start:start + meta_len].decode("utf-8"))
+            self.data_start = start + meta_len
+            if not isinstance(index, dict):
+                mm.close()
+                return
+            # a truncated or damaged bundle keeps only the entries it still holds
+            self.index = {name: entry for name, entry in index.items() if self.fits(entry, len(mm))}
+            self.mm = mm
+        except (OSError, ValueError, struct.error):
+            self.index = {}
+
+    def fits(self, entry, length):
+        try:
+            (w, h), offset = entry["size"], entry["offset"]
+            numbers = (w, h, offset, entry["mtime"], entry["bytes"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in numbers):
+            return False
+        return w > 0 and h > 0 and offset >= 0 and self.data_start + offset + w * h * 4 <= length
+
+    def fresh(self, name, source, size=None):
+        entry = self.index.get(name)
+        if entry is None or self.mm is None:
+            return False
+        if size is not None and tuple(entry["size"]) != tuple(size):
+            return False
+        try:
+            st = os.stat(source)
+        except OSError:
+            return True  # PNG gone, the baked copy is all there is
+        return entry["mtime"] == st.st_mtime_ns and entry["bytes"] == st.st_size
+
+    def load(self, name):
+        # The surface borrows the mapped pixels; the display-format
+        # conversion on the main thread makes the owned copy
+        entry = self.index[name]
+        w, h = entry["size"]
+        start = self.data_start + entry["offset"]
+        return pygame.image.frombuffer(memoryview(self.mm)[start:start + w * h * 4], (w, h), "RGBA")
+
+# ---------------- Scaled Surface Cache ----------------
+# Target sizes never change between frames, so every scaled copy is made once
+# and kept in a shared LRU keyed by (source image, target size, alpha variant).
+SCALE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+class ScaledSurfaceCache:
+    def __init__(self, max_bytes=SCALE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (scaled surface, source surface, byte size); the source is
+        # held so its id() cannot be reused while the entry is alive
+        self.entries = OrderedDict()
+
+    def get(self, image, size, alpha=None):
+        key = (id(image), size, alpha)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        if alpha is None and image.get_size() == size:
+            surf = image  # already baked at this size
+        else:
+            surf = pygame.transform.scale(image, size)
+        if alpha is not None:
+            surf.set_alpha(alpha)
+        nbytes = 0 if surf is image else surf.get_pitch() * surf.get_height()
+        self.entries[key] = (surf, image, nbytes)
+        self.bytes_used += nbytes
+        self.evict()
+        return surf
+
+    def evict(self):
+        # always keep the most recent entry, even if it alone exceeds the cap
+        while self.bytes_used > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, nbytes) = self.entries.popitem(last=False)
+            self.bytes_used -= nbytes
+
+    def discard_source(self, image):
+        for key in [k for k, v in self.entries.items() if v[1] is image]:
+            self.bytes_used -= self.entries.pop(key)[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes_used = 0
+
+SCALE_CACHE = ScaledSurfaceCache()
+
+def scaled(image, size, alpha=None):
+    return SCALE_CACHE.get(image, (int(size[0]), int(size[1])), alpha)
+
+# ---------------- Text Cache ----------------
+# Rendered strings are kept in an LRU keyed by (font, text, colour, antialias)
+# so static text (messages, the keypad display, tooltips) is rasterised once.
+# Tooltips are cached as finished panels. Text that changes all the time
+# (counters, the profiler HUD) goes through a glyph atlas instead: each
+# character is rendered once into a shared sheet and strings are assembled
+# by blitting glyphs, so a new string costs no font rendering at all.
+TEXT_CACHE_ENTRIES = 256
+ATLAS_CHARS = "".join(chr(c) for c in range(32, 127))
+
+class GlyphAtlas:
+    def __init__(self, font, color, antialias=True):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.height = font.get_height()
+        widths = [font.size(ch)[0] for ch in ATLAS_CHARS]
+        # transparent pixels carry the text colour, so blended edges don't darken
+        self.sheet = pygame.Surface((max(1, sum(widths)), self.height), pygame.SRCALPHA)
+        self.sheet.fill(tuple(color[:3]) + (0,))
+        self.glyphs = {}
+        x = 0
+        for ch, w in zip(ATLAS_CHARS, widths):
+            self.sheet.blit(font.render(ch, antialias, color), (x, 0))
+            self.glyphs[ch] = pygame.Rect(x, 0, w, self.height)
+            x += w
+
+    def width(self, text):
+        glyphs = self.glyphs
+        return sum(glyphs[ch].width if ch in glyphs else self.font.size(ch)[0] for ch in text)
+
+    def size(self, text):
+        return self.width(text), self.height
+
+    def draw(self, screen, text, pos):
+        x, y = pos
+        for ch in text:
+            area = self.glyphs.get(ch)
+            if area is not None:
+                screen.blit(self.sheet, (x, y), area)
+                x += area.width
+            else:
+                glyph = TEXT_CACHE.render(self.font, ch, self.color, self.antialias)
+                screen.blit(glyph, (x, y))
+                x += glyph.get_width()
+
+class TextCache:
+    def __init__(self, max_entries=TEXT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.atlases = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        surf = self.entries.get(key)
+        if surf is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return surf
+
+    def store(self, key, surf):
+        self.misses += 1
+        self.entries[key] = surf
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return surf
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, color, antialias)
+        surf = self.lookup(key)
+        if surf is None:
+            surf = self.store(key, font.render(text, antialias, color))
+        return surf
+
+    def panel(self, font, text, color, background, border):
+        # text on a filled, outlined box with 5/3 px padding
+        key = ("panel", font, text, color, background, border)
+        surf = self.lookup(key)
+        if surf is None:
+            label = self.render(font, text, color)
+            surf = pygame.Surface((label.get_width() + 10, label.get_height() + 6))
+            surf.fill(background)
+            pygame.draw.rect(surf, border, surf.get_rect(), 1)
+            surf.blit(label, (5, 3))
+            self.store(key, surf)
+        return surf
+
+    def atlas(self, font, color, antialias=True):
+        key = (font, color, antialias)
+        atlas = self.atlases.get(key)
+        if atlas is None:
+            atlas = self.atlases[key] = GlyphAtlas(font, color, antialias)
+        return atlas
+
+    def clear(self):
+        self.entries.clear()
+        self.atlases.clear()
+
+TEXT_CACHE = TextCache()
+
+def text_surface(font, text, color, antialias=True):
+    return TEXT_CACHE.render(font, text, color, antialias)
 
 # Colors
 WHITE = (255, 255, 255)
@@ -85,6 +572,63 @@ DARK_GRAY = (64, 64, 64)
 GREEN = (0, 255, 0)
 YELLOW = (255, 255, 0)
 
+# ---------------- Render Target ----------------
+# Game coordinates are always WINDOW_WIDTH x WINDOW_HEIGHT: rooms.json, the
+# simulation, input and hit tests all use them. Frames are drawn into a
+# render target of RENDER_SIZE. A Projection maps every rect into it, and
+# each texture is scaled once to its size there; the scale cache and the
+# per-resolution bundle hold those variants. The whole target is then
+# scaled to the window in one pass. When the render size matches the
+# window, the target is the window and there is no final pass.
+RENDER_SIZE = (WINDOW_WIDTH, WINDOW_HEIGHT)
+DISPLAY_SIZE = (WINDOW_WIDTH, WINDOW_HEIGHT)
+FULLSCREEN = False
+SMOOTH_UPSCALE = False
+
+class Projection:
+    def __init__(self, size, base=(WINDOW_WIDTH, WINDOW_HEIGHT)):
+        self.size = tuple(size)
+        self.sx = self.size[0] / base[0]
+        self.sy = self.size[1] / base[1]
+        self.identity = self.size == tuple(base)
+
+    def rect(self, r):
+        if self.identity:
+            return r
+        # map the edges, so neighbouring rects stay flush
+        x, y = round(r[0] * self.sx), round(r[1] * self.sy)
+        return pygame.Rect(x, y, round((r[0] + r[2]) * self.sx) - x, round((r[1] + r[3]) * self.sy) - y)
+
+    def point(self, p):
+        if self.identity:
+            return p
+        return round(p[0] * self.sx), round(p[1] * self.sy)
+
+    def scale_size(self, size):
+        if self.identity:
+            return size
+        return max(1, round(size[0] * self.sx)), max(1, round(size[1] * self.sy))
+
+    def length(self, n):
+        return n if self.identity else max(1, round(n * self.sy))
+
+IDENTITY = Projection((WINDOW_WIDTH, WINDOW_HEIGHT))
+
+def bundle_path(size):
+    if tuple(size) == (WINDOW_WIDTH, WINDOW_HEIGHT):
+        return BUNDLE_PATH
+    return os.path.join(TEXTURES_DIR, f"assets_{size[0]}x{size[1]}.bundle")
+
+def render_asset_sizes(size):
+    projection = Projection(size)
+    return {name: projection.scale_size(s) for name, s in ASSET_SIZES.items()}
+
+def present_display(rects):
+    if rects is None:
+        pygame.display.flip()
+    else:
+        pygame.display.update(rects)
+
 # ---------------- Classes ----------------
 class KeyPad:
     def __init__(self, x, y, button_size=40, spacing=10, layer=0):
@@ -107,94 +651,208 @@ class KeyPad:
                 'index': idx
             })
 
-    def draw(self, screen, font):
-        mouse_pos = pygame.mouse.get_pos()
-        self.hovered_button = next((b['index'] for b in self.buttons if b['rect'].collidepoint(mouse_pos)), None)
+    # Button alpha variants: normal, hovered, pressed
+    BUTTON_ALPHAS = (None, 200, 100)
+
+    def prebake(self, projection=IDENTITY):
+        # Warm the scale cache so the first frame in room 2 doesn't stall
+        body, display, button = ASSETS.get("keypad_extra"), ASSETS.get("keypad_display"), ASSETS.get("button")
+        if body:
+            scaled(body, projection.rect(self.rect).size)
+        if display:
+            scaled(display, projection.rect(self.display_rect).size)
+        if button:
+            for size in {projection.rect(b['rect']).size for b in self.buttons}:
+                for alpha in self.BUTTON_ALPHAS:
+                    scaled(button, size, alpha)
+
+    def update_hover(self, mouse_pos):
+        self.hovered_button = self.button_at(mouse_pos)
 
-        if KEYPAD_EXTRA_IMAGE:
+    def bounds(self):
+        return self.rect.union(self.display_rect)
+
+    def render_state(self):
+        return (self.input, self.hovered_button, self.pressed_button)
+
+    def static_state(self):
+        return self.input  # hover and press only touch the buttons
+
+    def draw(self, screen, font, projection=IDENTITY):
+        self.draw_static(screen, font, projection)
+        self.draw_buttons(screen, projection)
+
+    def draw_static(self, screen, font, projection=IDENTITY):
+        body, display = ASSETS.get("keypad_extra"), ASSETS.get("keypad_display")
+        rect = projection.rect(self.rect)
+        if body:
             try:
-                screen.blit(pygame.transform.scale(KEYPAD_EXTRA_IMAGE, (self.rect.width, self.rect.height)), self.rect)
+                screen.blit(scaled(body, rect.size), rect)
             except Exception:
-                pygame.draw.rect(screen, DARK_GRAY, self.rect)
+                pygame.draw.rect(screen, DARK_GRAY, rect)
         else:
-            pygame.draw.rect(screen, DARK_GRAY, self.rect)
+            pygame.draw.rect(screen, DARK_GRAY, rect)
 
-        if KEYPAD_DISPLAY_IMAGE:
+        display_rect = projection.rect(self.display_rect)
+        if display:
             try:
-                screen.blit(pygame.transform.scale(KEYPAD_DISPLAY_IMAGE, (self.display_rect.width, self.display_rect.height)), self.display_rect)
+                screen.blit(scaled(display, display_rect.size), display_rect)
             except Exception:
-                pygame.draw.rect(screen, WHITE, self.display_rect)
-                pygame.draw.rect(screen, BLACK, self.display_rect, 2)
+                pygame.draw.rect(screen, WHITE, display_rect)
+                pygame.draw.rect(screen, BLACK, display_rect, 2)
         else:
-            pygame.draw.rect(screen, WHITE, self.display_rect)
-            pygame.draw.rect(screen, BLACK, self.display_rect, 2)
+            pygame.draw.rect(screen, WHITE, display_rect)
+            pygame.draw.rect(screen, BLACK, display_rect, 2)
 
-        input_text = font.render(self.input, True, BLACK)
-        screen.blit(input_text, (self.display_rect.centerx - input_text.get_width() // 2, self.display_rect.centery - input_text.get_height() // 2))
+        input_text = text_surface(font, self.input, BLACK)
+        screen.blit(input_text, (display_rect.centerx - input_text.get_width() // 2, display_rect.centery - input_text.get_height() // 2))
 
+    def draw_buttons(self, screen, projection=IDENTITY):
+        button = ASSETS.get("button")
         for b in self.buttons:
-            if BUTTON_IMAGE:
+            button_rect = projection.rect(b['rect'])
+            if button:
                 try:
-                    img = pygame.transform.scale(BUTTON_IMAGE, (b['rect'].width, b['rect'].height))
                     if b['index'] == self.pressed_button:
-                        img.set_alpha(100)
+                        alpha = 100
                     elif b['index'] == self.hovered_button:
-                        img.set_alpha(200)
-                    screen.blit(img, b['rect'])
+                        alpha = 200
+                    else:
+                        alpha = None
+                    screen.blit(scaled(button, button_rect.size, alpha), button_rect)
                 except Exception:
-                    pygame.draw.rect(screen, GRAY, b['rect'])
+                    pygame.draw.rect(screen, GRAY, button_rect)
             else:
-                pygame.draw.rect(screen, GRAY, b['rect'])
+                pygame.draw.rect(screen, GRAY, button_rect)
+
+    def button_at(self, pos):
+        # Buttons sit on a regular grid, so the hit is plain arithmetic
+        dx, dy = pos[0] - self.x, pos[1] - self.y
+        if dx < 0 or dy < 0:
+            return None
+        pitch = self.button_size + self.spacing
+        col, row = dx // pitch, dy // pitch
+        if col >= 3 or row >= 4 or dx % pitch >= self.button_size or dy % pitch >= self.button_size:
+            return None
+        return row * 3 + col
+
+    def texture_name(self):
+        return None  # hit-tested per button, never by mask
+
+    def texture_names(self):
+        return ("keypad_extra", "keypad_display", "button")
+
+    def save_state(self):
+        return {"input": self.input}
+
+    def load_state(self, state):
+        self.input = state["input"]
+
+    def hit_test(self, pos):
+        return self.button_at(pos) is not None
 
     def check_click(self, pos):
-        for b in self.buttons:
-            if b['rect'].collidepoint(pos):
-                idx = b['index']
-                if idx == 9 and self.input:
-                    self.input = self.input[:-1]
-                elif idx == 11:
-                    return self.input
-                elif idx < 9 and len(self.input) < 5:
-                    self.input += str(idx + 1)
-                elif idx == 10 and len(self.input) < 5:
-                    self.input += "0"
-                return None
+        idx = self.button_at(pos)
+        if idx is None:
+            return None
+        if idx == 9 and self.input:
+            self.input = self.input[:-1]
+        elif idx == 11:
+            return self.input
+        elif idx < 9 and len(self.input) < 5:
+            self.input += str(idx + 1)
+        elif idx == 10 and len(self.input) < 5:
+            self.input += "0"
         return None
 
 class Item:
-    def __init__(self, x, y, width, height, color, name, layer=0):
+    def __init__(self, x, y, width, height, color, name, layer=0, image=None, open_image=None):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = color
         self.name = name
         self.is_collected = False
         self.is_open = False
         self.layer = layer
+        self.image = image
+        self.open_image = open_image
+        self.home_pos = (x, y)
+
+        # dropping in from above the screen (the rope)
+        self.drop_target_y = None
+        self.dropping = False
+        self.fy = float(y)
+
+    def bounds(self):
+        return self.rect
+
+    def render_state(self):
+        return (self.is_collected, self.is_open)
+
+    def static_state(self):
+        return self.render_state()
+
+    def texture_name(self):
+        if self.is_open and self.open_image and ASSETS.get(self.open_image):
+            return self.open_image
+        return self.image
+
+    def texture_names(self):
+        return tuple(name for name in (self.image, self.open_image) if name)
+
+    def start_drop(self, instant=False):
+        self.is_collected = False
+        self.dropping = not instant
+        self.rect.y = self.drop_target_y if instant else -self.rect.height
+        self.fy = float(self.rect.y)
+
+    def return_home(self):
+        self.is_collected = False
+        self.rect.topleft = self.home_pos
 
-    def draw(self, screen):
+    def step(self, dt, area):
+        if self.dropping and not self.is_collected:
+            self.fy += DROP_SPEED * dt
+            if self.fy >= self.drop_target_y:
+                self.fy = float(self.drop_target_y)
+                self.dropping = False
+            self.rect.y = int(self.fy)
+
+    def save_state(self):
+        return {"pos": self.rect.topleft, "collected": self.is_collected, "open": self.is_open,
+                "dropping": self.dropping, "fy": self.fy}
+
+    def load_state(self, state):
+        self.rect.topleft = tuple(state["pos"])
+        self.is_collected = state["collected"]
+        self.is_open = state["open"]
+        self.dropping = state["dropping"]
+        self.fy = state["fy"]
+
+    def hit_test(self, pos):
+        return not self.is_collected and self.rect.collidepoint(pos) and mask_hit(self, pos)
+
+    def draw(self, screen, projection=IDENTITY):
         if self.is_collected:
             return
-        img = None
-        if self.name in ("door", "exit_door"):
-            img = DOOR_OPEN_IMAGE if self.is_open and DOOR_OPEN_IMAGE else DOOR_IMAGE
-        elif self.name == "key":
-            img = KEY_IMAGE
-        elif self.name == "rope":
-            img = ROPE_IMAGE
+        name = self.texture_name()
+        img = ASSETS.get(name) if name else None
+        rect = projection.rect(self.rect)
         if img:
             try:
-                screen.blit(pygame.transform.scale(img, (self.rect.width, self.rect.height)), self.rect)
+                screen.blit(scaled(img, rect.size), rect)
             except Exception:
-                pygame.draw.rect(screen, self.color, self.rect)
+                pygame.draw.rect(screen, self.color, rect)
         else:
-            pygame.draw.rect(screen, self.color, self.rect)
+            pygame.draw.rect(screen, self.color, rect)
 
 class DraggableBox:
-    def __init__(self, x, y, width, height, color, image=None, layer=0):
+    def __init__(self, x, y, width, height, color, image_name=None, layer=0):
         self.rect = pygame.Rect(x, y, width, height)
         self.color = color
         self.dragging = False
         self.drag_offset = (0, 0)
-        self.image = image
+        self.drag_target_x = None
+        self.image_name = image_name
         self.fixed_y = y
         self.layer = layer
 
@@ -202,425 +860,3398 @@ class DraggableBox:
         if self.rect.collidepoint(pos):
             self.dragging = True
             self.drag_offset = (self.rect.x - pos[0], 0)
+            self.drag_target_x = self.rect.x
             return True
         return False
 
     def stop_drag(self):
         self.dragging = False
+        self.drag_target_x = None
+
+    def texture_name(self):
+        return self.image_name
+
+    def texture_names(self):
+        return (self.image_name,) if self.image_name else ()
+
+    def save_state(self):
+        return {"pos": self.rect.topleft}
+
+    def load_state(self, state):
+        self.rect.topleft = tuple(state["pos"])
+
+    def hit_test(self, pos):
+        return self.rect.collidepoint(pos) and mask_hit(self, pos)
+
+    def bounds(self):
+        return self.rect
+
+    def render_state(self):
+        return None
 
     def update(self, pos):
         if self.dragging:
-            self.rect.x += int(((pos[0] + self.drag_offset[0]) - self.rect.x) * 0.5)
+            self.drag_target_x = pos[0] + self.drag_offset[0]
+
+    def step(self, dt, area):
+        # Close half the gap every 1/60 s, whatever the tick rate
+        if self.dragging and self.drag_target_x is not None:
+            follow = 1.0 - 0.5 ** (dt * 60)
+            self.rect.x += int((self.drag_target_x - self.rect.x) * follow)
             self.rect.y = self.fixed_y
-            self.rect.clamp_ip(pygame.display.get_surface().get_rect())
+            self.rect.clamp_ip(area)
 
-    def draw(self, screen):
-        if self.image:
+    def draw(self, screen, projection=IDENTITY):
+        image = ASSETS.get(self.image_name) if self.image_name else None
+        rect = projection.rect(self.rect)
+        if image:
             try:
-                screen.blit(pygame.transform.scale(self.image, (self.rect.width, self.rect.height)), self.rect)
+                screen.blit(scaled(image, rect.size), rect)
             except Exception:
-                pygame.draw.rect(screen, self.color, self.rect)
+                pygame.draw.rect(screen, self.color, rect)
         else:
-            pygame.draw.rect(screen, self.color, self.rect)
+            pygame.draw.rect(screen, self.color, rect)
 
-# ---------------- Game ----------------
-class Game:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-        pygame.display.set_caption("Dungeon of Whispers")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.Font(None, 36)
-        self.small_font = pygame.font.Font(None, 24)
+# ---------------- Hit Testing ----------------
+# Each room keeps its clickable objects in a uniform grid. A click looks only
+# at the objects overlapping its cell and returns the top-most hit by layer.
+# Moving objects are re-bucketed only when their rect actually changes.
+# With PIXEL_PERFECT_HITS, a hit must also land on an opaque pixel of the
+# object's texture; masks are built by the renderer once a room's textures
+# are in, and objects without one fall back to their bounding box.
+SPATIAL_CELL_SIZE = 128
+PIXEL_PERFECT_HITS = False
 
-        for tex in [CHEST_IMAGE, BUTTON_IMAGE, DOOR_IMAGE, KEY_IMAGE, DOOR_OPEN_IMAGE, KEYPAD_EXTRA_IMAGE, KEYPAD_DISPLAY_IMAGE, SLOT_IMAGE, ROPE_IMAGE]:
-            if tex:
-                try:
-                    tex.convert_alpha()
-                except Exception:
-                    pass
+HIT_MASKS = {}  # (texture name, size) -> pygame.mask.Mask
 
-        # Room objects
-        self.chest = DraggableBox(100, 500, 150, 150, GRAY, image=CHEST_IMAGE, layer=3)
-        self.door = Item(650, 235, 400, 400, GREEN, "door", layer=1)
-        self.key = Item(self.chest.rect.centerx - 16, self.chest.rect.y - 40, 32, 32, YELLOW, "key", layer=4)
-        self.keypad = KeyPad(50, 400, layer=1)
+def mask_hit(obj, pos):
+    if not PIXEL_PERFECT_HITS:
+        return True
+    name = obj.texture_name()
+    mask = HIT_MASKS.get((name, obj.rect.size)) if name else None
+    if mask is None:
+        return True
+    return bool(mask.get_at((pos[0] - obj.rect.x, pos[1] - obj.rect.y)))
 
-        self.rope = Item(500, -500, 64, 500, YELLOW, "rope", layer=2)
-        self.rope.is_collected = True  # hidden initially
+def build_hit_mask(name, size):
+    image = ASSETS.get(name)
+    if image is not None and (name, size) not in HIT_MASKS:
+        HIT_MASKS[(name, size)] = pygame.mask.from_surface(scaled(image, size))
 
-        self.has_key = False
-        self.inventory = []
-        self.dragging_item = None
-        self.drag_offset = (0, 0)
+class SpatialGrid:
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}   # obj -> (rect as inserted, cell keys, insertion order)
+        self.order = itertools.count()
 
-        self.message = ""
-        self.message_timer = 0
+    def cell_keys(self, rect):
+        cs = self.cell_size
+        return [(cx, cy)
+                for cx in range(rect.left // cs, (rect.right - 1) // cs + 1)
+                for cy in range(rect.top // cs, (rect.bottom - 1) // cs + 1)]
+
+    def insert(self, obj):
+        rect = obj.bounds()
+        keys = self.cell_keys(rect)
+        for key in keys:
+            self.cells.setdefault(key, []).append(obj)
+        self.entries[obj] = (tuple(rect), keys, next(self.order))
 
-        # ---------------- Room 3 collectible items ----------------
-        self.room3_items = []
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            bucket = self.cells[key]
+            bucket.remove(obj)
+            if not bucket:
+                del self.cells[key]
 
-        # Example vase fragments
-        fragment_width = 50
-        fragment_height = 50  # <= 220 pixels
-        fragment_color = (200, 150, 100)
+    def update(self, obj):
+        entry = self.entries.get(obj)
+        rect = obj.bounds()
+        if entry is not None and entry[0] == tuple(rect):
+            return
+        keys = self.cell_keys(rect)
+        if entry is not None and entry[1] == keys:
+            self.entries[obj] = (tuple(rect), keys, entry[2])
+            return
+        self.remove(obj)
+        self.insert(obj)
 
-        # Place a few scattered in Room 3
-        positions = [(200, 500), (400, 540), (700, 520)]
-        for pos in positions:
-            item = Item(pos[0], pos[1], fragment_width, fragment_height, fragment_color, "vase_fragment")
-            self.room3_items.append(item)
+    def __contains__(self, obj):
+        return obj in self.entries
 
-        # Example Room 3 fragments
-        self.room3_items = [
-            Item(200, 540, 32, 32, (200, 100, 50), "vase_frag1"),
-            Item(400, 550, 32, 32, (180, 150, 70), "vase_frag2"),
-            Item(700, 520, 32, 32, (150, 180, 90), "vase_frag3")
-        ]
+    def query_point(self, pos):
+        cs = self.cell_size
+        best = None
+        best_key = None
+        for obj in self.cells.get((pos[0] // cs, pos[1] // cs), ()):
+            key = (obj.layer, self.entries[obj][2])
+            if (best_key is None or key > best_key) and obj.hit_test(pos):
+                best, best_key = obj, key
+        return best
 
-        # store original positions
-        for frag in self.room3_items:
-            frag.home_pos = frag.rect.topleft
+# ---------------- Dirty Rect Renderer ----------------
+# Remembers the rect and visual state of everything drawn last frame and only
+# repaints (and pushes to the display) the regions that changed. The first
+# frame and room transitions fall back to a full redraw and flip.
+DIRTY_RENDERING = True
+DIRTY_FULL_REDRAW_RATIO = 0.6
 
-        # BROKEN VASE
-        self.broken_vase = Item(500, 200, 64, 128, (150, 100, 50), "broken_vase")
-        self.vase_repaired = False  # state of the vase
+class DirtyRenderer:
+    def __init__(self, screen_rect, present=present_display):
+        self.screen_rect = screen_rect
+        self.present = present
+        self.previous = {}
+        self.force_full = True
+        self.full_redraws = 0
+        self.partial_redraws = 0
 
+    def invalidate(self):
+        self.force_full = True
 
+    def diff(self, elements):
+        # elements: {key: (rect, state)}; rects must be copies, not live object rects
+        dirty = []
+        previous = self.previous
+        for key, (rect, state) in elements.items():
+            old = previous.get(key)
+            if old is None:
+                dirty.append(rect)
+            elif old[0] != rect or old[1] != state:
+                dirty.append(old[0])
+                dirty.append(rect)
+        for key, (rect, state) in previous.items():
+            if key not in elements:
+                dirty.append(rect)
+        self.previous = elements
+        return dirty
 
-        # rooms
-        self.current_room = 1
-        self.backgrounds = {1: BG1, 2: BG2, 3: BG3}
-        self.transition_alpha = 0
-        self.transition_direction = 0
-        self.target_room = None
+    def merge(self, rects):
+        merged = []
+        for r in rects:
+            r = r.clip(self.screen_rect)
+            if r.width <= 0 or r.height <= 0:
+                continue
+            i = 0
+            while i < len(merged):
+                if merged[i].colliderect(r):
+                    r = r.union(merged.pop(i))
+                    i = 0
+                else:
+                    i += 1
+            merged.append(r)
+        return merged
 
-        # animations
-        self.animations = []
+    def render(self, screen, elements, draw_scene, full=False):
+        dirty = self.diff(elements)
+        if full or self.force_full:
+            # a full frame (e.g. a fade overlay) also forces the next one, so
+            # nothing from it is left behind on screen
+            self.force_full = full
+            self.full_redraws += 1
+            draw_scene()
+            self.present(None)
+            return
+
+        rects = self.merge(dirty)
+        if not rects:
+            return
+        area = sum(r.width * r.height for r in rects)
+        if area >= self.screen_rect.width * self.screen_rect.height * DIRTY_FULL_REDRAW_RATIO:
+            self.full_redraws += 1
+            draw_scene()
+            self.present(None)
+            return
+
+        self.partial_redraws += 1
+        for r in rects:
+            screen.set_clip(r)
+            draw_scene()
+        screen.set_clip(None)
+        self.present(rects)
+
+# ---------------- Inventory ----------------
+# Entries are dicts kept in slot order, plus a name index. Picking up an item
+# whose name is already held stacks it if its spec says "stack", otherwise
+# the extra copy is ignored. Every change bumps `version`, which is what the
+# renderer keys its cached slot strip on. Slots wrap into rows that fit the
+# window, and finding the slot under the cursor is plain arithmetic.
+class Inventory:
+    def __init__(self, slot_count=3, x=10, y=10, slot_size=64, padding=6):
+        if slot_count < 1:
+            raise ValueError(f"an inventory needs at least one slot, not {slot_count}")
+        self.slot_count = slot_count
+        self.x = x
+        self.y = y
+        self.slot_size = slot_size
+        self.padding = padding
+        self.pitch = slot_size + padding
+        self.columns = max(1, min(slot_count, (WINDOW_WIDTH - 2 * x + padding) // self.pitch))
+        self.slots = []
+        self.by_name = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __getitem__(self, index):
+        return self.slots[index]
+
+    def has(self, name):
+        return name in self.by_name
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def names(self):
+        return [entry['name'] for entry in self.slots]
+
+    def index(self, name):
+        return self.slots.index(self.by_name[name])
+
+    def full(self):
+        return len(self.slots) >= self.slot_count
+
+    def add(self, name, icon=None, desc='', origin=None, stack=False):
+        # Returns the slot the item went to, or None if there is no room. A
+        # second non-stacking item with a held name has no room either.
+        entry = self.by_name.get(name)
+        if entry is not None:
+            if not stack:
+                return None
+            entry['count'] += 1
+            entry['origins'].append(origin)
+            self.version += 1
+            return self.index(name)
+        if self.full():
+            return None
+        entry = {'name': name, 'icon': icon, 'desc': desc, 'count': 1, 'origins': [origin], 'stack': stack}
+        self.slots.append(entry)
+        self.by_name[name] = entry
+        self.version += 1
+        return len(self.slots) - 1
+
+    def remove(self, name):
+        entry = self.by_name.pop(name, None)
+        if entry is not None:
+            self.slots.remove(entry)
+            self.version += 1
+        return entry
+
+    def take(self, index):
+        # One unit out of a slot (for dragging); the slot goes once it's empty
+        entry = self.slots[index]
+        if entry['count'] > 1:
+            entry['count'] -= 1
+            origin = entry['origins'].pop()
+            self.version += 1
+            return dict(entry, count=1, origins=[origin])
+        self.remove(entry['name'])
+        return entry
+
+    def clear(self):
+        self.slots = []
+        self.by_name = {}
+        self.version += 1
+
+    def snapshot(self, extra=None):
+        entries = list(self.slots) + ([extra] if extra else [])
+        return [dict(entry, origins=[list(o) if o else None for o in entry['origins']]) for entry in entries]
+
+    def restore(self, entries):
+        self.clear()
+        for entry in entries:
+            entry = dict(entry, origins=[tuple(o) if o else None for o in entry['origins']])
+            self.slots.append(entry)
+            self.by_name[entry['name']] = entry
+
+    # ---------------- Layout ----------------
+    def slot_rect(self, index):
+        row, col = divmod(index, self.columns)
+        return pygame.Rect(self.x + col * self.pitch, self.y + row * self.pitch, self.slot_size, self.slot_size)
+
+    def slot_center(self, index):
+        return self.slot_rect(index).center
+
+    def slot_at(self, pos):
+        # Index of the held item under pos, or None
+        dx, dy = pos[0] - self.x, pos[1] - self.y
+        if dx < 0 or dy < 0 or dx % self.pitch >= self.slot_size or dy % self.pitch >= self.slot_size:
+            return None
+        col, row = dx // self.pitch, dy // self.pitch
+        if col >= self.columns:
+            return None
+        index = row * self.columns + col
+        return index if index < min(self.slot_count, len(self.slots)) else None
+
+    def rect(self):
+        rows = (self.slot_count + self.columns - 1) // self.columns
+        cols = min(self.slot_count, self.columns)
+        return pygame.Rect(self.x, self.y, cols * self.pitch - self.padding, rows * self.pitch - self.padding)
+
+# ---------------- Scene ----------------
+# Rooms, their objects, layers and puzzle triggers are declared in rooms.json.
+# Only the room the player is in exists as live objects; leaving a room saves
+# each object's state and drops the room, entering one rebuilds it from its
+# spec plus that saved state. Triggers can reach objects in other rooms, which
+# then only get their saved state updated.
+SCENE_PATH = os.path.join(BASE_DIR, "rooms.json")
+SCENE_VERSION = 1
+TRIGGER_ACTIONS = ("drop", "reveal", "hide", "open", "close", "set_flag")
+
+class Room:
+    def __init__(self, room_id, background, objects):
+        self.id = room_id
+        self.background = background
+        self.objects = sorted(objects, key=lambda obj: obj.layer)   # draw order
+        self.by_id = {obj.id: obj for obj in objects}
+        self.movers = [obj for obj in self.objects if obj.movable]
+        # everything drawn before the first mover can be baked into one layer
+        self.statics = self.objects[:self.objects.index(self.movers[0])] if self.movers else list(self.objects)
+        self.draggables = [obj for obj in self.objects if isinstance(obj, DraggableBox)]
+        self.riders = [obj for obj in self.objects if "rides_on" in obj.props]
+        self.keypads = [obj for obj in self.objects if isinstance(obj, KeyPad)]
+        self.grid = SpatialGrid()
+        for obj in self.objects:
+            self.grid.insert(obj)
+
+    def get(self, obj_id):
+        return self.by_id.get(obj_id)
+
+    def save(self):
+        return {obj.id: obj.save_state() for obj in self.objects}
+
+class Scene:
+    def __init__(self, data, path=SCENE_PATH):
+        if data.get("version") != SCENE_VERSION:
+            raise ValueError(f"{path}: unsupported scene version {data.get('version')!r}")
+        self.start_room = data["start_room"]
+        self.rooms = {int(room_id): room for room_id, room in data["rooms"].items()}
+        self.specs = {(room_id, spec["id"]): spec
+                      for room_id, room in self.rooms.items() for spec in room["objects"]}
+        self.flags = data.get("flags", {})
+        self.inventory_slots = data.get("inventory", {}).get("slots", 3)
+        if not isinstance(self.inventory_slots, int) or self.inventory_slots < 1:
+            raise ValueError(f"{path}: inventory slots must be a whole number of at least 1")
+        self.default_music = data.get("music")
+        lighting = data.get("lighting", {})
+        self.lights = {room_id: dict(lighting, **room.get("lighting", {})) for room_id, room in self.rooms.items()}
+        self.goals = data.get("goals", [])
+        self.triggers = data.get("triggers", [])
+        self.defaults = {}
+        for trigger in self.triggers:
+            for action in trigger.get("actions", ()):
+                if action["do"] not in TRIGGER_ACTIONS:
+                    raise ValueError(f"{path}: unknown trigger action {action['do']!r}")
+
+    def spec(self, room_id, obj_id):
+        return self.specs[(room_id, obj_id)]
+
+    def music(self, room_id):
+        return self.rooms[room_id].get("music", self.default_music)
+
+    def lighting(self, room_id):
+        return self.lights[room_id]
+
+    def default_state(self, room_id, obj_id):
+        key = (room_id, obj_id)
+        state = self.defaults.get(key)
+        if state is None:
+            state = self.defaults[key] = self.build_object(room_id, obj_id).save_state()
+        return state
+
+    def build_object(self, room_id, obj_id, state=None):
+        spec = self.spec(room_id, obj_id)
+        kind = spec["type"]
+        layer = spec.get("layer", 0)
+        if kind == "keypad":
+            obj = KeyPad(*spec["pos"], button_size=spec.get("button_size", 40),
+                         spacing=spec.get("spacing", 10), layer=layer)
+        elif kind == "draggable":
+            obj = DraggableBox(*spec["rect"], tuple(spec["color"]), image_name=spec.get("image"), layer=layer)
+        elif kind == "item":
+            obj = Item(*spec["rect"], tuple(spec["color"]), spec.get("name", obj_id), layer,
+                       spec.get("image"), spec.get("open_image"))
+            obj.is_collected = spec.get("hidden", False)
+            obj.is_open = spec.get("open", False)
+            obj.drop_target_y = spec.get("drop_to_y")
+        else:
+            raise ValueError(f"Unknown object type {kind!r} for {obj_id!r} in room {room_id}")
+        obj.id = obj_id
+        obj.props = spec
+        obj.movable = kind == "draggable" or "drop_to_y" in spec or "rides_on" in spec
+        if state:
+            obj.load_state(state)
+        return obj
+
+    def instantiate(self, room_id, saved):
+        room = self.rooms[room_id]
+        objects = [self.build_object(room_id, spec["id"], saved.get(spec["id"])) for spec in room["objects"]]
+        return Room(room_id, room["background"], objects)
+
+    def room_assets(self):
+        assets = {}
+        for room_id in self.rooms:
+            room = self.instantiate(room_id, {})
+            names = [room.background]
+            for obj in room.objects:
+                names.extend(obj.texture_names())
+            assets[room_id] = tuple(dict.fromkeys(names))
+        return assets
+
+    def neighbours(self):
+        return {room_id: tuple(sorted({spec["leads_to"] for spec in room["objects"] if "leads_to" in spec}))
+                for room_id, room in self.rooms.items()}
+
+def load_scene(path=SCENE_PATH):
+    with open(path) as f:
+        return Scene(json.load(f), path)
+
+SCENE = None
+
+def get_scene():
+    global SCENE
+    if SCENE is None:
+        SCENE = load_scene()
+    return SCENE
+
+# ---------------- Simulation ----------------
+# All game state and rules, stepped with a fixed timestep. Nothing in here
+# touches the display, the mouse or the clock, so it runs headless at
+# thousands of ticks per second and gameplay speed no longer depends on FPS.
+SIM_DT = 1.0 / 60
+MAX_FRAME_DT = 0.25          # longest frame the accumulator will catch up on
+DROP_SPEED = 480             # px per second (8 px per 60 Hz tick)
+TRANSITION_TIME = 0.7        # seconds from the old room to the new one
+MESSAGE_DURATION = 3.0       # seconds
+
+# What a snapshot (and so a save game) has to hold
+SNAPSHOT_FIELDS = {"room": int, "tick": int, "time": (int, float), "flags": dict, "inventory": list, "rooms": dict}
+
+class Inputs:
+    # One tick's worth of input: mouse state plus ordered ('down'|'up'|'move', pos) events
+    def __init__(self, mouse_pos=(0, 0), mouse_pressed=False, events=None):
+        self.mouse_pos = mouse_pos
+        self.mouse_pressed = mouse_pressed
+        self.events = events if events is not None else []
+
+class Simulation:
+    def __init__(self, scene=None):
+        self.scene = scene if scene is not None else get_scene()
+        self.area = pygame.Rect(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
+        self.tick = 0
+        self.time = 0.0
+
+        self.inventory = Inventory(self.scene.inventory_slots)
+        self.dragging_item = None
+        self.drag_offset = (0, 0)
+        self.hovered_slot = None
+        self.mouse_pos = (0, 0)
+
+        self.message = ""
+        self.message_timer = 0.0
+        self.flags = dict(self.scene.flags)
+
+        # bumped whenever something worth saving may have changed
+        self.revision = 0
 
-        # rope drop animation
-        self.rope_animating = False
-        self.rope_target_y = -100
+        # rooms: only the current one is live, the rest are saved object states
+        self.saved_rooms = {}
+        self.current_room = self.scene.start_room
+        self.room = self.scene.instantiate(self.current_room, {})
+        # the room changes on the tick a transition starts; the presentation
+        # then has TRANSITION_TIME to get from the old room's picture to it
+        self.target_room = None
+        self.transition_from = None
+        self.transition_elapsed = 0.0
+
+        # Positions at the start of the last tick, for render interpolation
+        self.prev_positions = {}
 
-        # inventory UI
-        self.inv_x = 10
-        self.inv_y = 10
-        self.slot_size = 64
-        self.inv_padding = 6
-        self.slot_count = 3
+        # Things the presentation layer should react to (animations, sounds)
+        self.events = []
 
     # ---------------- Utility ----------------
-    def show_message(self, text, duration=180):
+    def show_message(self, text, duration=MESSAGE_DURATION):
         self.message = text
         self.message_timer = duration
 
-    def start_room_transition(self, target_room):
-        self.transition_alpha = 0
-        self.transition_direction = 1
-        self.target_room = target_room
-
-        if target_room == 3:
-            self.door.is_open = False
-             # Move door up 86 pixels
-            self.door.rect.y -= 86
-        
-        else:
-            # Reset to original Y when leaving room 3
-            self.door.rect.y = 235
-
-
-    def update_transition(self):
-        if self.transition_direction != 0:
-            step = 12
-            self.transition_alpha += step * self.transition_direction
-            if self.transition_alpha >= 255:
-                self.transition_alpha = 255
-                self.transition_direction = -1
-                self.current_room = self.target_room
-            elif self.transition_alpha <= 0:
-                self.transition_alpha = 0
-                self.transition_direction = 0
-
-            fade = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
-            fade.fill((0,0,0))
-            fade.set_alpha(self.transition_alpha)
-            self.screen.blit(fade, (0, 0))
+    def drain_events(self):
+        events, self.events = self.events, []
+        return events
 
-    def start_pickup_animation(self, image, start_pos, slot_index, duration_ms=500):
-        end = self.get_slot_center(slot_index)
-        iw, ih = image.get_size()
-        anim = {
-            'type': 'pickup',
-            'image': image,
-            'start_pos': tuple(start_pos),
-            'end_pos': tuple(end),
-            'start_time': pygame.time.get_ticks(),
-            'duration': duration_ms,
-            'start_scale': 1.0,
-            'end_scale': 1.0,
-            'start_alpha': 255,
-            'end_alpha': 255,
-            'size': (iw, ih)
-        }
-        self.animations.append(anim)
+    def obj(self, obj_id):
+        return self.room.get(obj_id)
 
-    def start_use_animation(self, image, start_pos, target_pos, duration_ms=500):
-        iw, ih = image.get_size()
-        anim = {
-            'type': 'use',
-            'image': image,
-            'start_pos': tuple(start_pos),
-            'end_pos': tuple(target_pos),
-            'start_time': pygame.time.get_ticks(),
-            'duration': duration_ms,
-            'start_scale': 1.0,
-            'end_scale': 0.2,
-            'start_alpha': 255,
-            'end_alpha': 0,
-            'size': (iw, ih)
+    def has_item(self, name):
+        return self.inventory.has(name)
+
+    def settled(self):
+        # no transition running and nothing still dropping into place
+        return not self.transitioning() and not any(
+            isinstance(obj, Item) and obj.dropping for obj in self.room.movers)
+
+    def idle(self):
+        # nothing changes from here on until input arrives or the message expires
+        return (self.settled() and self.dragging_item is None
+                and not any(box.dragging for box in self.room.draggables))
+
+    def skip_idle_ticks(self, count, dt):
+        # The clock and message bookkeeping of `count` input-free steps of an
+        # idle simulation, which is all those steps would change
+        for _ in range(count):
+            self.tick += 1
+            self.time += dt
+            if self.message_timer > 0:
+                self.message_timer -= dt
+                if self.message_timer <= 0:
+                    self.message = ""
+        self.prev_positions = {}
+
+    def enter_room(self, room_id):
+        self.saved_rooms[self.room.id] = self.room.save()
+        self.room = self.scene.instantiate(room_id, self.saved_rooms.pop(room_id, {}))
+        self.current_room = room_id
+        self.prev_positions = {}
+        self.revision += 1
+
+    def snapshot(self):
+        # Plain data only; objects still at their spec defaults are left out
+        rooms = dict(self.saved_rooms)
+        rooms[self.room.id] = self.room.save()
+        changed = {}
+        for room_id, objects in rooms.items():
+            diff = {obj_id: state for obj_id, state in objects.items()
+                    if state != self.scene.default_state(room_id, obj_id)}
+            if diff:
+                changed[str(room_id)] = diff
+        return {
+            "room": self.current_room,
+            "tick": self.tick,
+            "time": self.time,
+            "flags": dict(self.flags),
+            "inventory": self.inventory.snapshot(self.dragging_item),
+            "rooms": changed,
         }
-        self.animations.append(anim)
-
-    def update_and_render_animations(self):
-        now = pygame.time.get_ticks()
-        to_remove = []
-        for anim in self.animations:
-            t = min(1.0, (now - anim['start_time']) / anim['duration'])
-            x = anim['start_pos'][0] + (anim['end_pos'][0] - anim['start_pos'][0]) * t
-            y = anim['start_pos'][1] + (anim['end_pos'][1] - anim['start_pos'][1]) * t
-            scale = anim['start_scale'] + (anim['end_scale'] - anim['start_scale']) * t
-            alpha = int(anim['start_alpha'] + (anim['end_alpha'] - anim['start_alpha']) * t)
-            if anim['image']:
-                iw, ih = anim['size']
-                w = max(1, int(iw * scale))
-                h = max(1, int(ih * scale))
-                img = pygame.transform.smoothscale(anim['image'], (w, h))
-                img.set_alpha(alpha)
-                draw_rect = img.get_rect(center=(int(x), int(y)))
-                self.screen.blit(img, draw_rect)
-            if t >= 1.0:
-                to_remove.append(anim)
-        for anim in to_remove:
-            self.animations.remove(anim)
-
-    def get_slot_center(self, index):
-        sx = self.inv_x + index * (self.slot_size + self.inv_padding)
-        sy = self.inv_y
-        return (sx + self.slot_size // 2, sy + self.slot_size // 2)
+
+    @classmethod
+    def from_snapshot(cls, data, scene=None):
+        # Data that doesn't fit this game is a ValueError, same as an unreadable save
+        if not isinstance(data, dict):
+            raise ValueError("save data is not an object")
+        for key, kind in SNAPSHOT_FIELDS.items():
+            value = data.get(key)
+            if not isinstance(value, kind) or isinstance(value, bool):
+                raise ValueError(f"save has no valid {key!r}")
+        sim = cls(scene)
+        if data["room"] not in sim.scene.rooms:
+            raise ValueError(f"save is in room {data['room']}, which this scene doesn't have")
+        try:
+            sim.tick = data["tick"]
+            sim.time = data["time"]
+            sim.flags.update(data["flags"])
+            sim.inventory.restore(data["inventory"])
+            sim.saved_rooms = {int(room_id): objects for room_id, objects in data["rooms"].items()}
+            sim.current_room = data["room"]
+            sim.room = sim.scene.instantiate(sim.current_room, sim.saved_rooms.pop(sim.current_room, {}))
+            for room_id, objects in sim.saved_rooms.items():
+                sim.scene.instantiate(room_id, objects)  # fail now, not on the way in
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"save doesn't match this game: {e!r}")
+        return sim
+
+    def with_object(self, room_id, obj_id, fn):
+        # Apply fn to an object whether or not its room is the live one
+        if room_id == self.room.id:
+            obj = self.room.get(obj_id)
+            fn(obj)
+            self.room.grid.update(obj)
+        else:
+            saved = self.saved_rooms.setdefault(room_id, {})
+            obj = self.scene.build_object(room_id, obj_id, saved.get(obj_id))
+            fn(obj)
+            saved[obj_id] = obj.save_state()
+
+    def transitioning(self):
+        return self.target_room is not None or self.transition_from is not None
+
+    def transition_progress(self, ahead=0.0):
+        # 0..1 through the running transition; `ahead` is extra time since the last tick
+        return min(1.0, (self.transition_elapsed + ahead) / TRANSITION_TIME)
+
+    def start_room_transition(self, target_room):
+        self.target_room = target_room  # entered at the end of this tick
+
+    def update_transition(self, dt):
+        if self.target_room is not None:
+            self.transition_from = self.current_room
+            self.transition_elapsed = 0.0
+            self.enter_room(self.target_room)
+            self.target_room = None
+            self.events.append(('transition', self.transition_from, self.current_room))
+        elif self.transition_from is not None:
+            self.transition_elapsed += dt
+            if self.transition_elapsed >= TRANSITION_TIME:
+                self.transition_from = None
+                self.transition_elapsed = 0.0
 
     # ---------------- Click / Drag ----------------
     def dragging_item_dropped(self, x, y, item):
-        # Room 3 fragments
-        room3_names = [frag.name for frag in self.room3_items]
-        if item['name'] in room3_names:
-            # find the original fragment object
-            frag = next(f for f in self.room3_items if f.name == item['name'])
-            frag.is_collected = False
-            frag.rect.topleft = frag.home_pos
-            self.show_message(f"You dropped a shard back onto the floor.")
-        elif item['name'] == 'key':
-            self.key = Item(x - 16, y - 16, 32, 32, YELLOW, "key")
-            self.key.is_collected = False
-            self.has_key = False
-            self.show_message("You dropped the key back onto the chest.")
-        else:
+        # Items go back where they came from (the key rides its chest again)
+        self.revision += 1
+        origin = item['origins'][0]
+        if origin is None:
             self.show_message(f"Dropped {item['name']} into the room.")
-    def draw_inventory(self, mouse_pos, mouse_pressed):
-        hovered_slot = None
-        for i in range(self.slot_count):
-            sx = self.inv_x + i * (self.slot_size + self.inv_padding)
-            sy = self.inv_y
-            slot_rect = pygame.Rect(sx, sy, self.slot_size, self.slot_size)
-            if SLOT_IMAGE:
-                try:
-                    self.screen.blit(pygame.transform.scale(SLOT_IMAGE, (self.slot_size, self.slot_size)), slot_rect)
-                except Exception:
-                    pygame.draw.rect(self.screen, DARK_GRAY, slot_rect)
-            else:
-                pygame.draw.rect(self.screen, DARK_GRAY, slot_rect)
-            pygame.draw.rect(self.screen, BLACK, slot_rect, 2)
-
-            if i < len(self.inventory):
-                item = self.inventory[i]
-                if item.get('image'):
-                    try:
-                        img = pygame.transform.scale(item['image'], (self.slot_size - 10, self.slot_size - 10))
-                        self.screen.blit(img, (sx + 5, sy + 5))
-                    except Exception:
-                        pygame.draw.rect(self.screen, YELLOW, (sx + 5, sy + 5, self.slot_size - 10, self.slot_size - 10))
-                else:
-                    pygame.draw.rect(self.screen, YELLOW, (sx + 5, sy + 5, self.slot_size - 10, self.slot_size - 10))
+            return
+        self.with_object(origin[0], origin[1], Item.return_home)
+        spec = self.scene.spec(*origin)
+        self.show_message(spec.get("drop_message", f"Dropped {item['name']} into the room."))
 
-                if slot_rect.collidepoint(mouse_pos) and mouse_pressed and not self.dragging_item:
-                    self.dragging_item = item
-                    self.drag_offset = (slot_rect.x - mouse_pos[0], slot_rect.y - mouse_pos[1])
-                    self.inventory.remove(item)
-                    hovered_slot = item
+    def update_inventory_drag(self, mouse_pos, mouse_pressed):
+        hovered_slot = None
+        if not mouse_pressed or self.dragging_item:
+            return hovered_slot
+        index = self.inventory.slot_at(mouse_pos)
+        if index is not None:
+            slot_rect = self.inventory.slot_rect(index)
+            item = self.inventory.take(index)
+            self.dragging_item = item
+            self.drag_offset = (slot_rect.x - mouse_pos[0], slot_rect.y - mouse_pos[1])
+            hovered_slot = item
         return hovered_slot
 
     def handle_click(self, pos):
-        # ---------- Room 2 keypad ----------
-        if self.current_room == 2:
-            result = self.keypad.check_click(pos)
-            if result:
-                self.show_message(f"Code entered: {result}")
-                if result == "25167":
-                    self.rope.is_collected = False
-                    self.rope_animating = True
-                    self.rope.rect.y = -self.rope.rect.height
-                    self.show_message("You hear the noise of a rope descending nearby.")
-                return
+        target = self.room.grid.query_point(pos)
+        if target is None:
+            return
+        self.revision += 1
+        action = target.props.get("action")
+        if action == "keypad":
+            self.use_keypad(target, pos)
+        elif action == "pickup":
+            self.pick_up(target)
+        elif action == "drag":
+            target.start_drag(pos)
+        elif action == "door":
+            self.use_door(target, pos)
+        elif action == "climb":
+            self.climb(target)
 
-        # ---------- Key pickup ----------
-        if self.current_room == 1 and not self.key.is_collected and self.key.rect.collidepoint(pos):
-            self.key.is_collected = True
-            self.has_key = True
-            if not any(it['name']=='key' for it in self.inventory):
-                self.inventory.append({'name': 'key', 'image': KEY_IMAGE, 'desc': 'A small brass key'})
-            self.start_pickup_animation(KEY_IMAGE, self.key.rect.center, len(self.inventory)-1)
-            self.show_message("Picked up the key!")
+    def use_keypad(self, keypad, pos):
+        result = keypad.check_click(pos)
+        if result:
+            self.show_message(f"Code entered: {result}")
+            self.fire_triggers("keypad_code", keypad, result)
+
+    def pick_up(self, item):
+        props = item.props
+        if self.inventory.has(item.name) and not props.get('stack', False):
+            # leave it where it is; one entry per name can't hold both
+            self.show_message(f"You already have a {item.name}.")
+            return
+        slot = self.inventory.add(item.name, props.get('icon'), props.get('desc', ''),
+                                  (self.room.id, item.id), props.get('stack', False))
+        if slot is None:
+            self.show_message("Your inventory is full.")
             return
+        item.is_collected = True
+        self.events.append(('pickup', item.texture_name(), item.color, item.rect.size, item.rect.center, slot))
+        self.show_message(props.get("message", f"Picked up {item.name}."))
 
-        # ---------- Chest drag ----------
-        if self.current_room == 1 and self.chest.start_drag(pos):
+    def use_door(self, door, pos):
+        props = door.props
+        if door.is_open:
+            if "leads_to" in props:
+                self.start_room_transition(props["leads_to"])
+                self.show_message(props["enter_message"])
             return
+        blocker = self.room.get(props.get("blocked_by"))
+        required = props.get("requires")
+        if blocker is not None and blocker.rect.colliderect(door.rect):
+            self.show_message(props["blocked_message"])
+        elif required and not self.has_item(required):
+            self.show_message(props["locked_message"])
+        else:
+            door.is_open = True
+            self.events.append(('sound', 'open'))
+            if required:
+                used = self.inventory.remove(required)
+                self.events.append(('use', used['icon'], pos))
+            self.show_message(props["open_message"])
 
-        # ---------- Door ----------
-        if self.door.rect.collidepoint(pos):
-            if self.current_room == 1:
-                if not self.door.is_open:
-                    if self.chest.rect.colliderect(self.door.rect):
-                        self.show_message("The chest is blocking the door")
-                    elif not self.has_key:
-                        self.show_message("You need the key to open the door")
-                    else:
-                        self.door.is_open = True
-                        if OPEN_SOUND:
-                            try: OPEN_SOUND.play()
-                            except Exception: pass
-                        self.start_use_animation(KEY_IMAGE, pos, pos, duration_ms=600)
-                        self.inventory = [it for it in self.inventory if it.get('name') != 'key']
-                        self.has_key = False
-                        self.show_message("You opened the door!")
-                else:
-                    self.start_room_transition(2)
-                    self.show_message("You entered the next room.")
-            elif self.current_room == 2:
-                self.start_room_transition(1)
-                self.show_message("You returned to the first room.")
-
-        # ---------- Rope click ----------
-        if self.current_room == 1 and not self.rope.is_collected and self.rope.rect.collidepoint(pos):
-            # Check if chest is under the rope
-            chest_center_x = self.chest.rect.centerx
-            rope_center_x = self.rope.rect.centerx
-            tolerance = 50  # pixels allowance
-            if abs(chest_center_x - rope_center_x) <= tolerance:
-                self.start_room_transition(3)
-                self.show_message("You grab the rope and ascend to an attic.")
-                self.rope.is_collected = True  # rope disappears after use
-            else:
-                self.show_message("The rope is too high. How can you reach it?")
+    def climb(self, rope):
+        props = rope.props
+        anchor = self.room.get(props.get("needs_under"))
+        if anchor is None or abs(anchor.rect.centerx - rope.rect.centerx) <= props.get("tolerance", 50):
+            self.start_room_transition(props["leads_to"])
+            self.show_message(props["enter_message"])
+            rope.is_collected = True  # rope disappears after use
+        else:
+            self.show_message(props["out_of_reach_message"])
+
+    def fire_triggers(self, event, source, value):
+        for trigger in self.scene.triggers:
+            if (trigger["on"] != event or trigger.get("room", self.room.id) != self.room.id
+                    or trigger.get("object", source.id) != source.id or trigger.get("code") != value):
+                continue
+            for action in trigger.get("actions", ()):
+                self.run_action(action)
+            if "message" in trigger:
+                self.show_message(trigger["message"])
 
-        # Room 3 items pickup
-        if self.current_room == 3:
-            for item in self.room3_items:
-                if not item.is_collected and item.rect.collidepoint(pos):
-                    item.is_collected = True
-                    # Add to inventory
-                    self.inventory.append({
-                        'name': item.name,
-                        'image': FRAGMENT_IMAGE,  # can keep None if you want
-                        'desc': 'A ceramic shard'
-                    })
-                    # create temporary image for animation
-                    fragment_img = pygame.Surface((item.rect.width, item.rect.height))
-                    fragment_img.fill(item.color)
-                    self.start_pickup_animation(fragment_img, item.rect.center, len(self.inventory)-1)
-                    self.show_message("Picked up a ceramic shard.")
-                    return
+    def run_action(self, action):
+        kind = action["do"]
+        if kind == "set_flag":
+            self.flags[action["flag"]] = action.get("value", True)
+            return
+        room = action.get("room", self.room.id)
+        if kind == "drop":
+            self.with_object(room, action["object"], Item.start_drop)
+        elif kind == "reveal":
+            self.with_object(room, action["object"], lambda obj: setattr(obj, "is_collected", False))
+        elif kind == "hide":
+            self.with_object(room, action["object"], lambda obj: setattr(obj, "is_collected", True))
+        elif kind == "open":
+            self.with_object(room, action["object"], lambda obj: setattr(obj, "is_open", True))
+        elif kind == "close":
+            self.with_object(room, action["object"], lambda obj: setattr(obj, "is_open", False))
 
+    # ---------------- Step ----------------
+    def step(self, dt, inputs):
+        self.tick += 1
+        self.time += dt
+        self.mouse_pos = inputs.mouse_pos
+        room = self.room
+        self.prev_positions = {obj: obj.rect.topleft for obj in room.movers}
 
+        for kind, pos in inputs.events:
+            if kind == 'down':
+                if not self.transitioning():
+                    self.handle_click(pos)
+            elif kind == 'up':
+                for box in room.draggables:
+                    if box.dragging:
+                        self.revision += 1
+                    box.stop_drag()
+            elif kind == 'move':
+                for box in room.draggables:
+                    box.update(pos)
 
+        for obj in room.movers:
+            obj.step(dt, self.area)
 
-    # ---------------- Main Loop ----------------
-    def run(self):
-        while True:
-            mouse_pos = pygame.mouse.get_pos()
-            mouse_pressed = pygame.mouse.get_pressed()[0]
-
-            for e in pygame.event.get():
-                if e.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                elif e.type == pygame.MOUSEBUTTONDOWN and e.button == 1:
-                    if self.transition_direction == 0:
-                        self.handle_click(e.pos)
-                elif e.type == pygame.MOUSEBUTTONUP and e.button == 1:
-                    self.chest.stop_drag()
-                elif e.type == pygame.MOUSEMOTION:
-                    self.chest.update(e.pos)
-
-            self.screen.blit(self.backgrounds[self.current_room], (0,0))
-
-            # Key stays on chest
-            if self.current_room == 1 and not self.key.is_collected:
-                self.key.rect.centerx = self.chest.rect.centerx
-                self.key.rect.y = self.chest.rect.y - self.key.rect.height - 5
-
-            # Draw room objects
-            if self.current_room == 1:
-                self.door.draw(self.screen)
-                self.chest.draw(self.screen)
-                self.key.draw(self.screen)
-                if not self.rope.is_collected:
-                    # Animate rope dropping
-                    if self.rope_animating:
-                        self.rope.rect.y += 8
-                        if self.rope.rect.y >= self.rope_target_y:
-                            self.rope.rect.y = self.rope_target_y
-                            self.rope_animating = False
-                    self.rope.draw(self.screen)
-            elif self.current_room == 2:
-                self.door.draw(self.screen)
-                self.keypad.draw(self.screen, self.font)
-            elif self.current_room == 3:
-                self.door.draw(self.screen)
-                for item in self.room3_items:
-                    item.draw(self.screen)
-
-            # Inventory
-            hovered_slot = self.draw_inventory(mouse_pos, mouse_pressed)
-            if self.dragging_item:
-                try:
-                    drag_img = pygame.transform.scale(self.dragging_item.get('image'), (self.slot_size - 10, self.slot_size - 10))
-                    self.screen.blit(drag_img, (mouse_pos[0] + self.drag_offset[0] + 20, mouse_pos[1] + self.drag_offset[1] + 20))
-                except Exception:
-                    pygame.draw.rect(self.screen, YELLOW, (mouse_pos[0]+20, mouse_pos[1]+20, self.slot_size-10, self.slot_size-10))
-                if not mouse_pressed:
-                    self.dragging_item_dropped(*mouse_pos, self.dragging_item)
-                    self.dragging_item = None
-
-            if hovered_slot:
-                desc = self.small_font.render(hovered_slot.get('desc', ''), True, WHITE)
-                tip_bg = pygame.Surface((desc.get_width() + 10, desc.get_height() + 6))
-                tip_bg.fill(DARK_GRAY)
-                pygame.draw.rect(tip_bg, WHITE, tip_bg.get_rect(), 1)
-                self.screen.blit(tip_bg, (mouse_pos[0]+10, mouse_pos[1]+10))
-                self.screen.blit(desc, (mouse_pos[0]+15, mouse_pos[1]+13))
-
-            self.update_and_render_animations()
-            self.update_transition()
+        for keypad in room.keypads:
+            keypad.update_hover(inputs.mouse_pos)
 
-            if self.message_timer > 0:
-                self.message_timer -= 1
-            if self.message:
-                msg = self.font.render(self.message, True, YELLOW)
-                self.screen.blit(msg, (WINDOW_WIDTH - msg.get_width() - 10, 10))
+        # Inventory
+        self.hovered_slot = self.update_inventory_drag(inputs.mouse_pos, inputs.mouse_pressed)
+        if self.dragging_item and not inputs.mouse_pressed:
+            self.dragging_item_dropped(*inputs.mouse_pos, self.dragging_item)
+            self.dragging_item = None
 
-            pygame.display.flip()
-            self.clock.tick(FPS)
+        # Riders (the key) stay on top of what they sit on
+        for obj in room.riders:
+            anchor = room.get(obj.props["rides_on"])
+            if anchor is not None and not obj.is_collected:
+                obj.rect.centerx = anchor.rect.centerx
+                obj.rect.y = anchor.rect.y - obj.rect.height - 5
+
+        for obj in room.movers:
+            room.grid.update(obj)
+
+        self.update_transition(dt)
+
+        if self.message_timer > 0:
+            self.message_timer -= dt
+            if self.message_timer <= 0:
+                self.message = ""
+
+def run_headless(ticks, dt=SIM_DT):
+    sim = Simulation()
+    idle = Inputs()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sim.step(dt, idle)
+    elapsed = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.3f}s ({ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+    return sim
+
+# ---------------- Frame Profiler ----------------
+# Splits each frame into phases and keeps a rolling window of timings per
+# phase. Game only calls into it when one is attached, so a disabled
+# profiler costs one truthiness check per phase.
+PROFILE_PHASES = ("events", "sim", "background", "room", "lighting", "inventory", "animations",
+                  "transition", "message", "hud", "present", "tick")
+PROFILE_WINDOW = 240        # frames kept for the rolling percentiles
+PROFILE_HUD_REFRESH = 30    # frames between HUD text updates
+
+class FrameProfiler:
+    def __init__(self, hud=False, out_path=None, window=PROFILE_WINDOW):
+        self.hud = hud
+        self.samples = {phase: deque(maxlen=window) for phase in PROFILE_PHASES}
+        self.current = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.last = time.perf_counter()
+        self.frame = 0
+        self.hud_lines = ()
+        self.hud_frame = 0
+
+        self.out = None
+        self.out_format = None
+        if out_path:
+            self.out = open(out_path, "w", buffering=1024 * 64)
+            self.out_format = "jsonl" if out_path.endswith((".jsonl", ".json")) else "csv"
+            if self.out_format == "csv":
+                self.out.write("frame," + ",".join(PROFILE_PHASES) + ",total\n")
+
+    def mark(self):
+        # Start timing from now without charging the gap to any phase
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self, refresh_hud=True):
+        current = self.current
+        for phase in PROFILE_PHASES:
+            self.samples[phase].append(current[phase])
+        if self.out:
+            ms = [current[phase] * 1000.0 for phase in PROFILE_PHASES]
+            if self.out_format == "csv":
+                self.out.write(f"{self.frame}," + ",".join(f"{v:.4f}" for v in ms) + f",{sum(ms):.4f}\n")
+            else:
+                row = {phase: round(v, 4) for phase, v in zip(PROFILE_PHASES, ms)}
+                row["frame"] = self.frame
+                self.out.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self.current = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.frame += 1
+        if self.hud and refresh_hud and self.frame - self.hud_frame >= PROFILE_HUD_REFRESH:
+            self.hud_lines = self.summary_lines()
+            self.hud_frame = self.frame
+
+    def percentiles(self, phase):
+        values = sorted(self.samples[phase])
+        if not values:
+            return 0.0, 0.0, 0.0
+        last = len(values) - 1
+        return tuple(values[int(last * q)] * 1000.0 for q in (0.50, 0.95, 0.99))
+
+    def summary_lines(self):
+        # One (phase, p50, p95, p99) row of strings per phase, in ms
+        lines = [("phase (ms)", "p50", "p95", "p99")]
+        for phase in PROFILE_PHASES:
+            lines.append((phase,) + tuple(f"{v:.2f}" for v in self.percentiles(phase)))
+        return tuple(lines)
+
+    def hud_rect(self, font):
+        line_h = font.get_linesize()
+        return pygame.Rect(10, 90, 240, line_h * (len(PROFILE_PHASES) + 1) + 8)
+
+    def draw_hud(self, screen, font):
+        rect = self.hud_rect(font)
+        pygame.draw.rect(screen, BLACK, rect)
+        pygame.draw.rect(screen, GRAY, rect, 1)
+        atlas = TEXT_CACHE.atlas(font, GREEN)
+        y = rect.y + 4
+        for name, *columns in self.hud_lines:
+            atlas.draw(screen, name, (rect.x + 6, y))
+            right = rect.x + 110
+            for text in columns:
+                right += 40
+                atlas.draw(screen, text, (right - atlas.width(text), y))
+            y += font.get_linesize()
+
+    def close(self):
+        if self.out:
+            self.out.close()
+            self.out = None
+
+# ---------------- Transitions ----------------
+# When a transition starts, the last frame of the old room is copied into a
+# snapshot; each frame the new room is drawn as usual and the effect lays the
+# snapshot (or black) over it. All overlays are allocated once and reused.
+#   fade       old room fades to black, then black fades into the new room
+#   crossfade  old room fades straight into the new one
+#   wipe       the new room slides in from the left edge
+#   dissolve   the old room breaks up in random blocks
+TRANSITION_EFFECTS = ("fade", "crossfade", "wipe", "dissolve")
+TRANSITION_EFFECT = "fade"
+DISSOLVE_BLOCK = 16
+DISSOLVE_SEED = 7
+
+class TransitionCompositor:
+    def __init__(self, size, effect=None):
+        self.size = size
+        self.effect = effect or TRANSITION_EFFECT
+        self.snapshot = pygame.Surface(size)
+        self.black = pygame.Surface(size)
+        self.black.fill(BLACK)
+        self.overlay = None          # dissolve only: the snapshot with holes punched in
+        self.blocks = None           # dissolve order, shuffled once
+        self.revealed = 0
+        self.active = False
+
+    def begin(self, screen):
+        self.snapshot.blit(screen, (0, 0))
+        self.active = True
+        if self.effect == "dissolve":
+            if self.overlay is None:
+                self.overlay = pygame.Surface(self.size, pygame.SRCALPHA)
+                self.blocks = self.dissolve_blocks()
+            self.overlay.blit(self.snapshot, (0, 0))
+            self.revealed = 0
+
+    def end(self):
+        self.active = False
+
+    def dissolve_blocks(self):
+        w, h = self.size
+        blocks = [pygame.Rect(x, y, DISSOLVE_BLOCK, DISSOLVE_BLOCK)
+                  for y in range(0, h, DISSOLVE_BLOCK) for x in range(0, w, DISSOLVE_BLOCK)]
+        # a fixed order keeps replays and benchmarks identical
+        seeded_shuffle(blocks, DISSOLVE_SEED)
+        return blocks
+
+    def draw(self, screen, progress):
+        effect = self.effect
+        if effect == "fade":
+            if progress < 0.5:
+                screen.blit(self.snapshot, (0, 0))
+                self.black.set_alpha(int(510 * progress))
+            else:
+                self.black.set_alpha(int(510 * (1.0 - progress)))
+            screen.blit(self.black, (0, 0))
+        elif effect == "crossfade":
+            self.snapshot.set_alpha(int(255 * (1.0 - progress)))
+            screen.blit(self.snapshot, (0, 0))
+            self.snapshot.set_alpha(None)
+        elif effect == "wipe":
+            x = int(self.size[0] * progress)
+            screen.blit(self.snapshot, (x, 0), pygame.Rect(x, 0, self.size[0] - x, self.size[1]))
+        elif effect == "dissolve":
+            target = int(len(self.blocks) * progress)
+            for rect in self.blocks[self.revealed:target]:
+                self.overlay.fill((0, 0, 0, 0), rect)
+            self.revealed = max(self.revealed, target)
+            screen.blit(self.overlay, (0, 0))
+
+def seeded_shuffle(items, seed):
+    # small LCG so the order doesn't depend on the random module's state
+    state = seed
+    for i in range(len(items) - 1, 0, -1):
+        state = (state * 1103515245 + 12345) & 0x7fffffff
+        j = state % (i + 1)
+        items[i], items[j] = items[j], items[i]
+
+# ---------------- Tweens ----------------
+# Item and particle animations. A tween only stores its endpoints; its
+# position, alpha and size are recomputed once per frame by the engine.
+# Scale is quantised to TWEEN_SCALE_STEPS sizes worked out when the tween
+# starts, and each (image, size) frame is smoothscaled once and shared by
+# every tween drawing it, so nothing is scaled per frame. Finished tweens
+# are swapped with the last one and popped.
+TWEEN_SCALE_STEPS = 12
+
+def ease_in_out(t):
+    return 2 * t * t if t < 0.5 else 1 - 2 * (1 - t) * (1 - t)
+
+EASINGS = {
+    "linear": lambda t: t,
+    "ease_in": lambda t: t * t,
+    "ease_out": lambda t: 1 - (1 - t) * (1 - t),
+    "ease_in_out": ease_in_out,
+}
+
+class Tween:
+    __slots__ = ("image", "x0", "y0", "x1", "y1", "a0", "a1", "start", "duration", "ease", "sizes",
+                 "rect", "alpha", "size")
+
+    def __init__(self, image, start_pos, end_pos, start_time, duration,
+                 start_scale=1.0, end_scale=1.0, start_alpha=255, end_alpha=255, ease="linear"):
+        self.image = image
+        self.x0, self.y0 = start_pos
+        self.x1, self.y1 = end_pos
+        self.a0 = start_alpha
+        self.a1 = end_alpha
+        self.start = start_time
+        self.duration = duration
+        self.ease = EASINGS[ease]
+        iw, ih = image.get_size()
+        steps = 1 if start_scale == end_scale else TWEEN_SCALE_STEPS
+        self.sizes = []
+        for i in range(steps):
+            scale = start_scale + (end_scale - start_scale) * i / max(1, steps - 1)
+            self.sizes.append((max(1, int(iw * scale)), max(1, int(ih * scale))))
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.alpha = start_alpha
+        self.size = self.sizes[0]
+
+    def advance(self, now):
+        # Returns False once the tween has run its course
+        elapsed = now - self.start
+        if elapsed >= self.duration:
+            return False
+        t = self.ease(elapsed / self.duration)
+        self.alpha = int(self.a0 + (self.a1 - self.a0) * t)
+        self.size = self.sizes[round(t * (len(self.sizes) - 1))]
+        self.rect.size = self.size
+        self.rect.center = (int(self.x0 + (self.x1 - self.x0) * t), int(self.y0 + (self.y1 - self.y0) * t))
+        return True
+
+class TweenEngine:
+    def __init__(self):
+        self.tweens = []
+        self.frames = {}   # (image, size) -> scaled copy owned by the engine
+
+    def add(self, image, start_pos, end_pos, start_time, duration, **kwargs):
+        tween = Tween(image, start_pos, end_pos, start_time, duration, **kwargs)
+        tween.advance(start_time)
+        self.tweens.append(tween)
+        return tween
+
+    def update(self, now):
+        tweens = self.tweens
+        i = 0
+        while i < len(tweens):
+            if tweens[i].advance(now):
+                i += 1
+            else:
+                tweens[i] = tweens[-1]
+                tweens.pop()
+        if not tweens and self.frames:
+            self.frames.clear()
+
+    def frame(self, image, size):
+        key = (image, size)
+        surf = self.frames.get(key)
+        if surf is None:
+            # a private copy even at full size, since its alpha gets changed
+            surf = image.copy() if image.get_size() == size else pygame.transform.smoothscale(image, size)
+            self.frames[key] = surf
+        return surf
+
+    def draw(self, screen, projection=IDENTITY):
+        for tween in self.tweens:
+            # the same rect the dirty renderer invalidates for this tween
+            r = projection.rect(tween.rect)
+            surf = self.frame(tween.image, r.size)
+            surf.set_alpha(tween.alpha)
+            screen.blit(surf, r.topleft)
+
+    def clear(self):
+        self.tweens = []
+        self.frames.clear()
+
+    def __iter__(self):
+        return iter(self.tweens)
+
+    def __len__(self):
+        return len(self.tweens)
+
+# ---------------- Frame Scheduling ----------------
+# When nothing is moving (no tweens, transitions, drags or drops) and no input
+# is waiting, the main loop blocks in pygame.event.wait instead of redrawing
+# at FPS, with a timer to wake it when the current message is due to expire.
+# The ticks slept through are accounted for on waking, so recordings and
+# replays still line up tick for tick.
+# The governor watches how long each frame's work takes. While frames run
+# over budget it publishes at most one loaded asset per frame and holds off
+# profiler HUD refreshes, and after several late frames in a row it draws
+# only every other frame. The simulation itself is never skipped.
+IDLE_SLEEP = True
+IDLE_WAKE_EVENT = pygame.USEREVENT + 1
+FRAME_BUDGET_MS = 1000.0 / FPS
+GOVERNOR_LATE_FRAMES = 3
+
+class FrameGovernor:
+    def __init__(self, budget_ms=None):
+        self.budget = (budget_ms or FRAME_BUDGET_MS) / 1000.0
+        self.start = time.perf_counter()
+        self.late_streak = 0
+        self.rendered_last = True
+        self.skipped_renders = 0
+
+    def begin(self):
+        self.start = time.perf_counter()
+
+    def end(self, rendered):
+        # only drawn frames say anything about whether drawing keeps up
+        if rendered:
+            late = time.perf_counter() - self.start > self.budget
+            self.late_streak = self.late_streak + 1 if late else 0
+
+    def late(self):
+        return self.late_streak > 0
+
+    def should_render(self):
+        if self.late_streak >= GOVERNOR_LATE_FRAMES and self.rendered_last:
+            self.rendered_last = False
+            self.skipped_renders += 1
+            return False
+        self.rendered_last = True
+        return True
+
+# ---------------- Input ----------------
+# Only the event types the game handles are let into SDL's queue. Each frame
+# the queue is drained through a type -> handler table into an InputFrame:
+# mouse position and left-button state as of the last event, the ordered
+# ('down'|'up'|'move', pos) events with runs of motion collapsed to the
+# latest position, and whether the window was asked to close. The rest of
+# the game reads that snapshot instead of asking pygame again.
+INPUT_EVENT_TYPES = (pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP,
+                     pygame.MOUSEMOTION, pygame.VIDEOEXPOSE, IDLE_WAKE_EVENT)
+
+class InputFrame:
+    __slots__ = ("mouse_pos", "mouse_pressed", "events", "quit")
+
+    def __init__(self, mouse_pos, mouse_pressed):
+        self.mouse_pos = mouse_pos
+        self.mouse_pressed = mouse_pressed
+        self.events = []
+        self.quit = False
+
+class InputLayer:
+    def __init__(self, to_logical=None):
+        self.handlers = {
+            pygame.QUIT: self.on_quit,
+            pygame.KEYDOWN: self.on_key,
+            pygame.MOUSEBUTTONDOWN: self.on_button_down,
+            pygame.MOUSEBUTTONUP: self.on_button_up,
+            pygame.MOUSEMOTION: self.on_motion,
+            pygame.VIDEOEXPOSE: self.on_expose,
+        }
+        self.key_bindings = {}
+        self.expose_callback = None
+        # window pixels -> game coordinates when the window is scaled
+        self.to_logical = to_logical or (lambda pos: pos)
+        self.mouse_pos = self.to_logical(pygame.mouse.get_pos())
+        self.mouse_pressed = False
+        self.frame = InputFrame(self.mouse_pos, self.mouse_pressed)
+        self.motion_events = 0
+        self.coalesced = 0
+
+    def install(self):
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(INPUT_EVENT_TYPES))
+
+    def bind_key(self, key, callback):
+        self.key_bindings[key] = callback
+
+    def poll(self):
+        frame = self.frame = InputFrame(self.mouse_pos, self.mouse_pressed)
+        handlers = self.handlers
+        for e in pygame.event.get():
+            handler = handlers.get(e.type)
+            if handler:
+                handler(e)
+        frame.mouse_pos = self.mouse_pos
+        frame.mouse_pressed = self.mouse_pressed
+        return frame
+
+    def on_quit(self, e):
+        self.frame.quit = True
+
+    def on_key(self, e):
+        callback = self.key_bindings.get(e.key)
+        if callback:
+            callback()
+
+    def on_button_down(self, e):
+        if e.button == 1:
+            pos = self.mouse_pos = self.to_logical(e.pos)
+            self.mouse_pressed = True
+            self.frame.events.append(('down', pos))
+
+    def on_button_up(self, e):
+        if e.button == 1:
+            pos = self.mouse_pos = self.to_logical(e.pos)
+            self.mouse_pressed = False
+            self.frame.events.append(('up', pos))
+
+    def on_motion(self, e):
+        pos = self.mouse_pos = self.to_logical(e.pos)
+        self.motion_events += 1
+        events = self.frame.events
+        if events and events[-1][0] == 'move':
+            events[-1] = ('move', pos)
+            self.coalesced += 1
+        else:
+            events.append(('move', pos))
+
+    def on_expose(self, e):
+        if self.expose_callback:
+            self.expose_callback()
+
+# ---------------- Audio ----------------
+# Effects are decoded into a sound bank on a worker thread and played on a
+# fixed pool of channels. When every channel is busy a new sound takes the
+# oldest one of equal or lower priority, otherwise it is dropped. Music is
+# streamed from disk by pygame.mixer.music; there is only one music stream,
+# so a room change fades the old track out and the new one in, stepping the
+# volume once per frame rather than blocking in fadeout(). Fades run at a
+# fixed rate from wherever the volume is, so a change of mind mid-fade turns
+# the ramp around instead of jumping or restarting the track.
+SOUND_PATHS = {
+    "open": OPEN_SOUND_PATH,
+}
+SOUND_PRIORITIES = {"open": 2}     # higher wins a contested channel
+MUSIC_PATHS = {
+    "theme": THEME_MUSIC_PATH,
+}
+AUDIO_CHANNELS = 8
+MUSIC_VOLUME = 0.5
+MUSIC_FADE_MS = 600                # each half of a track change
+
+class AudioManager:
+    def __init__(self, sounds=SOUND_PATHS, music=MUSIC_PATHS, channels=AUDIO_CHANNELS):
+        self.sound_paths = sounds
+        self.music_paths = music
+        self.channel_count = channels
+        self.enabled = False
+
+        # only touched on the main thread
+        self.bank = {}
+        self.failed = set()
+        self.channels = []      # [channel, priority, started]
+        self.seq = itertools.count()
+        self.played = 0
+        self.stolen = 0
+        self.dropped = 0
+
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = None
+
+        # music: the track playing, the one queued behind the fade-out
+        self.track = None
+        self.next_track = None
+        self.fade = None        # 'out' or 'in' while a track change runs
+        self.fade_start = 0.0
+        self.fade_from = 0.0    # volume when the running fade began
+        self.volume = 0.0
+
+    def start(self):
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+        except pygame.error as e:
+            print(f"Audio disabled: {e}")
+            return
+        self.enabled = True
+        pygame.mixer.set_num_channels(self.channel_count)
+        self.channels = [[pygame.mixer.Channel(i), 0, 0] for i in range(self.channel_count)]
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.work, name="sound-loader", daemon=True)
+            self.worker.start()
+        for name in self.sound_paths:
+            self.requests.put(name)
+
+    def work(self):
+        while True:
+            name = self.requests.get()
+            path = self.sound_paths[name]
+            sound = None
+            if os.path.exists(path):
+                try:
+                    sound = pygame.mixer.Sound(path)
+                except Exception as e:
+                    print(f"Failed to load sound {path}: {e}")
+            self.results.put((name, sound))
+
+    def pump(self):
+        while True:
+            try:
+                name, sound = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if sound is None:
+                self.failed.add(name)
+            else:
+                self.bank[name] = sound
+
+    def play(self, name, priority=None):
+        sound = self.bank.get(name)
+        if not self.enabled or sound is None:
+            return None
+        if priority is None:
+            priority = SOUND_PRIORITIES.get(name, 1)
+        slot = self.free_channel() or self.steal_channel(priority)
+        if slot is None:
+            self.dropped += 1
+            return None
+        slot[0].play(sound)
+        slot[1] = priority
+        slot[2] = next(self.seq)
+        self.played += 1
+        return slot[0]
+
+    def free_channel(self):
+        for slot in self.channels:
+            if not slot[0].get_busy():
+                return slot
+        return None
+
+    def steal_channel(self, priority):
+        victims = [slot for slot in self.channels if slot[1] <= priority]
+        if not victims:
+            return None
+        slot = min(victims, key=lambda s: (s[1], s[2]))
+        slot[0].stop()
+        self.stolen += 1
+        return slot
+
+    def play_music(self, track):
+        # None means silence
+        if not self.enabled:
+            return
+        if track == self.track:
+            # still playing, maybe on its way out: bring it back up from here
+            self.next_track = None
+            if self.fade == 'out':
+                self.begin_fade('in')
+            return
+        self.next_track = track
+        if self.track is None:
+            self.start_track()
+        elif self.fade != 'out':
+            self.begin_fade('out')
+
+    def begin_fade(self, direction):
+        self.fade = direction
+        self.fade_from = self.volume
+        self.fade_start = time.perf_counter()
+
+    def set_music_volume(self, volume):
+        self.volume = volume
+        pygame.mixer.music.set_volume(volume)
+
+    def start_track(self):
+        self.track, self.next_track = self.next_track, None
+        if self.track is None:
+            pygame.mixer.music.stop()
+            self.fade = None
+            return
+        try:
+            pygame.mixer.music.load(self.music_paths[self.track])
+            self.set_music_volume(0.0 if self.fade else MUSIC_VOLUME)
+            pygame.mixer.music.play(-1)
+        except Exception as e:
+            print(f"Failed to play music {self.track!r}: {e}")
+
+    def fading(self):
+        return self.fade is not None
+
+    def update(self):
+        # Once per frame on the main thread
+        if not self.enabled:
+            return
+        self.pump()
+        if self.fade is None:
+            return
+        step = MUSIC_VOLUME * (time.perf_counter() - self.fade_start) * 1000.0 / MUSIC_FADE_MS
+        if self.fade == 'out':
+            self.set_music_volume(max(0.0, self.fade_from - step))
+            if self.volume <= 0.0:
+                # old track is silent; the new one rises over the second half
+                self.begin_fade('in')
+                self.start_track()
+        else:
+            self.set_music_volume(min(MUSIC_VOLUME, self.fade_from + step))
+            if self.volume >= MUSIC_VOLUME:
+                self.fade = None
+
+AUDIO = AudioManager()
+
+# ---------------- Frame Capture ----------------
+# Frames are copied out of the render target into a small ring of
+# preallocated buffers: one memcpy from the surface's pixel buffer and no
+# per-frame allocation. Worker threads encode them, either as numbered PNGs
+# in a directory or appended to one raw video file. When every buffer is
+# still waiting to be encoded, the frame is dropped instead of holding up
+# the game loop. Scripted runs (fast replays) pass block=True and wait.
+# PNGs are deflated with zlib, which releases the GIL while it works;
+# pygame.image.save would hold it and stall the main thread.
+CAPTURE_BUFFERS = 8
+CAPTURE_WORKERS = 2      # PNG only; raw video is written in order by one thread
+CAPTURE_PNG_LEVEL = 1
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+def encode_png(surface, level=CAPTURE_PNG_LEVEL):
+    w, h = surface.get_size()
+    rgb = memoryview(surface_to_bytes(surface, "RGB"))
+    stride = w * 3
+    # filter type 0 (none) in front of every row
+    rows = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(h))
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+            + png_chunk(b"IDAT", zlib.compress(rows, level)) + png_chunk(b"IEND", b""))
+
+class FrameCapture:
+    def __init__(self, path, buffers=CAPTURE_BUFFERS, workers=CAPTURE_WORKERS, fps=FPS):
+        self.path = path
+        self.raw = path.lower().endswith(".raw")
+        self.buffer_count = max(1, buffers)
+        self.worker_count = 1 if self.raw else max(1, workers)
+        self.fps = fps
+        self.ring = None
+        self.format = None      # size, bitsize, masks of the captured surface
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        self.threads = []
+        self.out = None
+        self.captured = 0
+        self.dropped = 0
+
+    def start(self, surface):
+        size = surface.get_size()
+        self.format = (size, surface.get_bitsize(), surface.get_masks())
+        self.ring = [bytearray(surface.get_pitch() * size[1]) for _ in range(self.buffer_count)]
+        for slot in range(self.buffer_count):
+            self.free.put(slot)
+        if self.raw:
+            self.out = open(self.path, "wb")
+        else:
+            os.makedirs(self.path, exist_ok=True)
+        for n in range(self.worker_count):
+            thread = threading.Thread(target=self.work, name=f"frame-capture-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def capture(self, surface, block=False):
+        if self.ring is None:
+            self.start(surface)
+        try:
+            slot = self.free.get(block)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        self.ring[slot][:] = memoryview(surface.get_buffer())
+        self.filled.put((self.captured, slot))
+        self.captured += 1
+        return True
+
+    def work(self):
+        size, bitsize, masks = self.format
+        frame = None if self.raw else pygame.Surface(size, 0, bitsize, masks)
+        while True:
+            item = self.filled.get()
+            if item is None:
+                return
+            index, slot = item
+            if self.raw:
+                self.out.write(self.ring[slot])
+                self.free.put(slot)
+                continue
+            frame.get_buffer().write(bytes(self.ring[slot]))
+            self.free.put(slot)
+            try:
+                with open(os.path.join(self.path, f"frame_{index:06d}.png"), "wb") as f:
+                    f.write(encode_png(frame))
+            except OSError as e:
+                print(f"Failed to write frame {index}: {e}")
+
+    def pixel_format(self):
+        # ffmpeg's name for the captured layout, one letter per byte in memory
+        _, bitsize, masks = self.format
+        shifts = range(0, bitsize, 8)
+        if sys.byteorder == "big":
+            shifts = reversed(shifts)
+        names = dict(zip(masks, "rgba"))
+        return "".join(names.get(0xff << shift, "0") for shift in shifts)
+
+    def close(self):
+        if self.ring is None:
+            return
+        for _ in self.threads:
+            self.filled.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.raw:
+            self.out.close()
+            (w, h), _, _ = self.format
+            info = {"width": w, "height": h, "pix_fmt": self.pixel_format(), "fps": self.fps,
+                    "frames": self.captured}
+            with open(self.path + ".json", "w") as f:
+                json.dump(info, f, indent=2)
+
+    def report(self):
+        total = self.captured + self.dropped
+        return f"Captured {self.captured} of {total} frames ({self.dropped} dropped) to {self.path}"
+
+# ---------------- Lighting ----------------
+# Torch flicker, a vignette and a lamp following the cursor, multiplied over
+# the room (not the inventory, messages or HUD) with a BLEND_MULT blit. NumPy
+# builds everything a light configuration fixes once, at the render size: the
+# ambient/vignette base map and one glow per torch and for the lamp. These are
+# kept in a small LRU keyed by the configuration. At run time the light map is
+# only patched with plain blits, inside the rects of the lights that changed:
+# the base is restored there and the glows are added back, each torch's glow
+# dimmed to its current flicker level. Lights step LIGHT_HZ times a second:
+# flicker moves in FLICKER_LEVELS steps and only torches whose level changed
+# are repainted; the lamp follows once the cursor has moved LAMP_STEP pixels.
+# Each light is its own element for the dirty renderer, so a flicker repaints
+# one torch's rect, not the screen. Flicker only runs while frames are drawn
+# anyway, so it never keeps the game from idling. The repaints still cost a
+# millisecond or two on frames where a light steps, so lighting is off unless
+# --lighting asks for it. Without NumPy rooms are unlit.
+# "lighting" in rooms.json applies to every room and a room can override keys:
+#   {"ambient": 0.7, "tint": [r, g, b], "vignette": 0.5, "lamp": radius,
+#    "torches": [{"pos": [x, y], "radius": r, "color": [r, g, b], "flicker": 0.3}]}
+LIGHTING = False
+LIGHT_SCALE = 4             # maps are computed this much coarser, then smooth-scaled once
+LIGHT_HZ = 15               # flicker and lamp steps per second
+FLICKER_LEVELS = 16
+LAMP_STEP = 8               # pixels the cursor moves before the lamp follows
+LIGHT_CACHE_SIZE = 4        # light configurations kept
+TORCH_COLOR = (255, 170, 90)
+TORCH_STRENGTH = 0.5
+LAMP_COLOR = (255, 225, 180)
+LAMP_STRENGTH = 0.35
+
+LIGHT_CACHE = OrderedDict()
+
+def light_grid(size):
+    # cell centres on a LIGHT_SCALE times coarser grid, from -1 to 1 across
+    w, h = max(1, size[0] // LIGHT_SCALE), max(1, size[1] // LIGHT_SCALE)
+    xs = ((numpy.arange(w, dtype=numpy.float32) + 0.5) / w * 2 - 1)[:, None]
+    ys = ((numpy.arange(h, dtype=numpy.float32) + 0.5) / h * 2 - 1)[None, :]
+    return xs, ys
+
+def light_surface(values, size, like):
+    # float (w, h, 3) grid in 0..1 -> surface of `size` in the light map's format
+    grid = pygame.Surface(values.shape[:2], 0, like)
+    pygame.surfarray.blit_array(grid, (numpy.minimum(values, 1.0) * 255).astype(numpy.uint8))
+    return pygame.transform.smoothscale(grid, size)
+
+def glow(size, color, strength, like):
+    xs, ys = light_grid(size)
+    falloff = numpy.clip(1.0 - numpy.hypot(xs, ys), 0.0, 1.0) ** 2
+    return light_surface(falloff[:, :, None] * (numpy.asarray(color, numpy.float32) * (strength / 255)), size, like)
+
+class LightMaps:
+    def __init__(self, config, size, projection, like):
+        # ambient light, falling off towards the corners
+        xs, ys = light_grid(size)
+        shade = numpy.clip(1.0 - config.get("vignette", 0.0) * (xs ** 2 + ys ** 2) / 2, 0.0, 1.0)
+        tint = numpy.asarray(config.get("tint", WHITE), numpy.float32) / 255
+        self.base = light_surface((config.get("ambient", 1.0) * shade)[:, :, None] * tint, size, like)
+
+        # torches: render-space rect, glow, flicker depth
+        self.torches = []
+        for torch in config.get("torches", ()):
+            r = torch.get("radius", 200)
+            x, y = torch["pos"]
+            rect = projection.rect(pygame.Rect(x - r, y - r, 2 * r, 2 * r))
+            self.torches.append((rect, glow(rect.size, torch.get("color", TORCH_COLOR), TORCH_STRENGTH, like),
+                                 torch.get("flicker", 0.3)))
+        self.flicker = numpy.array([t[2] for t in self.torches], numpy.float32)
+        self.phases = numpy.arange(len(self.torches), dtype=numpy.float32) * 2.1
+
+        radius = config.get("lamp", 0)
+        self.lamp = None
+        if radius:
+            self.lamp = glow(projection.scale_size((2 * radius, 2 * radius)), LAMP_COLOR, LAMP_STRENGTH, like)
+
+    def nbytes(self):
+        surfaces = [self.base] + [t[1] for t in self.torches] + ([self.lamp] if self.lamp else [])
+        return sum(surface_bytes(surf) for surf in surfaces)
+
+    def levels(self, t):
+        # every torch's flicker level at time t, from a few detuned sines
+        p = self.phases
+        wave = numpy.sin(t * 7.3 + p) + 0.5 * numpy.sin(t * 13.7 + 2 * p) + 0.25 * numpy.sin(t * 23.1 + 3 * p)
+        flame = 1.0 - self.flicker * (wave / 1.75 + 1.0) / 2
+        return [int(v) for v in numpy.rint(flame * FLICKER_LEVELS)]
+
+def light_maps(config, size, projection, like):
+    key = (json.dumps(config, sort_keys=True), size, projection.sx, projection.sy)
+    maps = LIGHT_CACHE.get(key)
+    if maps is not None:
+        LIGHT_CACHE.move_to_end(key)
+        return maps
+    maps = LIGHT_CACHE[key] = LightMaps(config, size, projection, like)
+    while len(LIGHT_CACHE) > LIGHT_CACHE_SIZE:
+        LIGHT_CACHE.popitem(last=False)
+    return maps
+
+class Lighting:
+    def __init__(self, size, projection=IDENTITY):
+        self.size = size
+        self.projection = projection
+        self.surface = pygame.Surface(size, 0, 32)
+        self.config = None
+        self.maps = None
+        self.scratch = []       # per torch: its glow at the current level
+        self.levels = []
+        self.lamp_pos = None
+        self.lamp_rect = None
+        self.next_step = None
+        self.version = 0        # bumped on a new configuration only
+
+    def load(self, config):
+        self.config = config
+        self.maps = maps = light_maps(config, self.size, self.projection, self.surface)
+        self.scratch = [pygame.Surface(rect.size, 0, self.surface) for rect, _, _ in maps.torches]
+        self.levels = [None] * len(maps.torches)
+        self.lamp_pos = self.lamp_rect = None
+        self.next_step = None
+        self.version += 1
+
+    def lamp_target(self, cursor):
+        if self.maps.lamp is None:
+            return None
+        pos = self.projection.point(cursor)
+        if self.lamp_pos is not None and max(abs(pos[0] - self.lamp_pos[0]), abs(pos[1] - self.lamp_pos[1])) < LAMP_STEP:
+            return self.lamp_pos
+        return pos
+
+    def pending(self, cursor):
+        # only a lamp that hasn't caught up with the cursor needs another frame
+        return self.maps is not None and self.lamp_target(cursor) != self.lamp_pos
+
+    def repaint(self, rect):
+        surface = self.surface
+        surface.set_clip(rect)
+        surface.blit(self.maps.base, rect, rect)
+        for (torch_rect, _, _), scratch in zip(self.maps.torches, self.scratch):
+            if torch_rect.colliderect(rect):
+                surface.blit(scratch, torch_rect, special_flags=pygame.BLEND_ADD)
+        if self.lamp_rect is not None and self.lamp_rect.colliderect(rect):
+            surface.blit(self.maps.lamp, self.lamp_rect, special_flags=pygame.BLEND_ADD)
+        surface.set_clip(None)
+
+    def update(self, now_ms, cursor, config, hold=False):
+        dirty = []
+        if config is not self.config:
+            self.load(config)
+            dirty.append(self.surface.get_rect())
+
+        # fixed steps; a clock that jumped back (a reload, a replay) restarts them
+        interval = 1000 // LIGHT_HZ
+        due = self.next_step is None or now_ms >= self.next_step or self.next_step - now_ms > interval
+        if due and not hold:
+            self.next_step = now_ms + interval
+            self.step_lights(now_ms, cursor, dirty)
+
+        for rect in dirty:
+            self.repaint(rect)
+        return bool(dirty)
+
+    def step_lights(self, now_ms, cursor, dirty):
+        maps = self.maps
+        if maps.torches:
+            for i, level in enumerate(maps.levels(now_ms / 1000.0)):
+                if level != self.levels[i]:
+                    rect, glow_surface, _ = maps.torches[i]
+                    # alpha-blending onto black scales the glow; much cheaper than a BLEND_MULT fill
+                    scratch = self.scratch[i]
+                    scratch.fill(BLACK)
+                    glow_surface.set_alpha(min(255, 255 * level // FLICKER_LEVELS))
+                    scratch.blit(glow_surface, (0, 0))
+                    glow_surface.set_alpha(None)
+                    self.levels[i] = level
+                    dirty.append(rect)
+
+        pos = self.lamp_target(cursor)
+        if pos != self.lamp_pos:
+            if self.lamp_rect is not None:
+                dirty.append(self.lamp_rect)
+            self.lamp_pos = pos
+            self.lamp_rect = maps.lamp.get_rect(center=pos)
+            dirty.append(self.lamp_rect)
+
+    def elements(self):
+        # one dirty-renderer element per light, keyed apart from the room's objects
+        elements = {('light', 'base'): (self.surface.get_rect(), self.version)}
+        for i, (rect, _, _) in enumerate(self.maps.torches):
+            elements[('light', i)] = (pygame.Rect(rect), self.levels[i])
+        if self.lamp_rect is not None:
+            elements[('light', 'lamp')] = (pygame.Rect(self.lamp_rect), None)
+        return elements
+
+# ---------------- Scene View ----------------
+# Draws one Simulation onto one surface: the window for Game, an off-screen
+# surface per session for the session host. Fonts can be shared between
+# views; everything else here is per view.
+#
+# The background and every object drawn before the room's first mover are
+# baked into one static layer, so a frame is one blit plus the moving parts.
+# The layer is rebuilt only when one of those objects really changes (a door
+# opens, a shard is collected, a digit is typed) or new textures arrive.
+STATIC_LAYER = True
+
+def default_fonts(scale=1.0):
+    return tuple(pygame.font.Font(None, max(8, round(size * scale))) for size in (36, 24, 20))
+
+class SceneView:
+    def __init__(self, sim, screen, fonts=None, projection=IDENTITY, present=present_display):
+        self.sim = sim
+        self.screen = screen
+        self.projection = projection
+        self.present = present
+        self.font, self.small_font, self.hud_font = fonts or default_fonts(projection.sy)
+        self.profiler = None
+
+        # animations
+        self.tweens = TweenEngine()
+
+        # per-frame state shared by update and draw; scripted runs swap the
+        # clock for simulation time so animations replay identically
+        self.time_source = pygame.time.get_ticks
+        self.mouse_pos = (0, 0)
+        self.frame_ticks = self.time_source()
+        self.renderer = DirtyRenderer(self.screen.get_rect(), present)
+        self.compositor = TransitionCompositor(self.screen.get_size())
+        self.transition_progress = 0.0
+        self.strip = None
+        self.strip_key = None
+        self.layer = None
+        self.layer_key = None
+        self.layer_builds = 0
+        self.lighting = None
+        self.memory_lines = None    # the memory overlay while it is shown
+
+    # ---------------- Presentation ----------------
+    def item_image(self, texture, color, size):
+        if texture:
+            return ASSETS.get(texture)
+        # untextured items get a temporary image for the pickup animation
+        image = pygame.Surface(size)
+        image.fill(color)
+        return image
+
+    def icon_image(self, icon):
+        return ASSETS.get(icon) if icon else None
+
+    def draw_transition(self):
+        if self.compositor.active:
+            self.compositor.draw(self.screen, self.transition_progress)
+
+    def start_pickup_animation(self, image, start_pos, slot_index, duration_ms=500):
+        end = self.sim.inventory.slot_center(slot_index)
+        self.tweens.add(image, tuple(start_pos), tuple(end), self.time_source(), duration_ms, ease="ease_out")
+
+    def start_use_animation(self, image, start_pos, target_pos, duration_ms=500):
+        self.tweens.add(image, tuple(start_pos), tuple(target_pos), self.time_source(), duration_ms,
+                        end_scale=0.2, end_alpha=0, ease="ease_in")
+
+    def inventory_rect(self):
+        return self.projection.rect(self.sim.inventory.rect())
+
+    def inventory_strip(self):
+        # Slots and icons pre-rendered into one surface, rebuilt only when
+        # the inventory or the loaded assets change
+        inv = self.sim.inventory
+        key = (inv, inv.version, ASSETS.generation)
+        if self.strip_key == key:
+            return self.strip
+        projection = self.projection
+        rect = self.inventory_rect()
+        if self.strip is None or self.strip.get_size() != rect.size:
+            self.strip = pygame.Surface(rect.size, pygame.SRCALPHA)
+        strip = self.strip
+        strip.fill((0, 0, 0, 0))
+        slot_image = ASSETS.get("slot")
+        inset = projection.length(5)
+        for i in range(inv.slot_count):
+            slot_rect = projection.rect(inv.slot_rect(i)).move(-rect.x, -rect.y)
+            if slot_image:
+                try:
+                    strip.blit(scaled(slot_image, slot_rect.size), slot_rect)
+                except Exception:
+                    pygame.draw.rect(strip, DARK_GRAY, slot_rect)
+            else:
+                pygame.draw.rect(strip, DARK_GRAY, slot_rect)
+            pygame.draw.rect(strip, BLACK, slot_rect, 2)
+
+            if i < len(inv):
+                item = inv[i]
+                icon_rect = slot_rect.inflate(-2 * inset, -2 * inset)
+                image = self.icon_image(item.get('icon'))
+                if image:
+                    try:
+                        strip.blit(scaled(image, icon_rect.size), icon_rect)
+                    except Exception:
+                        pygame.draw.rect(strip, YELLOW, icon_rect)
+                else:
+                    pygame.draw.rect(strip, YELLOW, icon_rect)
+                if item['count'] > 1:
+                    count = text_surface(self.small_font, str(item['count']), WHITE)
+                    strip.blit(count, count.get_rect(bottomright=(slot_rect.right - inset + 1, slot_rect.bottom - 2)))
+        self.strip_key = key
+        return strip
+
+    def draw_inventory(self):
+        self.screen.blit(self.inventory_strip(), self.inventory_rect())
+
+    # ---------------- Static Layer ----------------
+    def draw_background(self, screen):
+        background = ASSETS.get(self.sim.room.background)
+        if background:
+            screen.blit(background, (0,0))
+        else:
+            screen.fill(BLACK)
+
+    def draw_static(self, screen, obj):
+        if isinstance(obj, KeyPad):
+            obj.draw_static(screen, self.font, self.projection)
+        else:
+            obj.draw(screen, self.projection)
+
+    def static_layer(self):
+        room = self.sim.room
+        key = (room, ASSETS.generation, tuple(obj.static_state() for obj in room.statics))
+        if self.layer_key == key:
+            return self.layer
+        if self.layer is None or self.layer.get_size() != self.screen.get_size():
+            self.layer = pygame.Surface(self.screen.get_size(), 0, self.screen)
+        self.draw_background(self.layer)
+        for obj in room.statics:
+            self.draw_static(self.layer, obj)
+        self.layer_key = key
+        self.layer_builds += 1
+        return self.layer
+
+    # ---------------- Memory ----------------
+    def memory_rows(self):
+        rows = [("view", "render target", surface_bytes(self.screen), True)]
+        if self.layer is not None:
+            rows.append(("view", "static layer", surface_bytes(self.layer), True))
+        if self.strip is not None:
+            rows.append(("view", "inventory strip", surface_bytes(self.strip), True))
+        comp = self.compositor
+        rows.append(("view", "transition buffers",
+                     sum(surface_bytes(surf) for surf in (comp.snapshot, comp.black, comp.overlay) if surf is not None),
+                     True))
+        if self.lighting:
+            rows.append(("view", "light map", surface_bytes(self.lighting.surface)
+                         + sum(surface_bytes(surf) for surf in self.lighting.scratch), True))
+        return rows
+
+    def refresh_memory_overlay(self):
+        totals = memory_totals(memory_ledger(self))
+        # (label, KiB) rows
+        lines = [(group, f"{nbytes / 1024:.0f}") for group, nbytes in totals.items()]
+        lines.append(("total", f"{sum(totals.values()) / 1024:.0f}"))
+        if ASSETS.budget is not None:
+            used = ASSETS.resident_bytes() + SCALE_CACHE.bytes_used
+            lines.append(("budget", f"{used / 1024:.0f}/{ASSETS.budget / 1024:.0f}"))
+        self.memory_lines = tuple(lines)
+
+    def memory_rect(self):
+        line_h = self.hud_font.get_linesize()
+        return pygame.Rect(self.screen.get_width() - 200, 50, 190, line_h * len(self.memory_lines) + 8)
+
+    def draw_memory(self):
+        rect = self.memory_rect()
+        pygame.draw.rect(self.screen, BLACK, rect)
+        pygame.draw.rect(self.screen, GRAY, rect, 1)
+        atlas = TEXT_CACHE.atlas(self.hud_font, GREEN)
+        y = rect.y + 4
+        for label, kib in self.memory_lines:
+            atlas.draw(self.screen, label, (rect.x + 6, y))
+            text = kib + " KiB"
+            atlas.draw(self.screen, text, (rect.right - 6 - atlas.width(text), y))
+            y += self.hud_font.get_linesize()
+
+    # ---------------- Frame ----------------
+    def room_objects(self):
+        return self.sim.room.objects
+
+    def drag_preview_rect(self):
+        sim = self.sim
+        size = sim.inventory.slot_size - 10
+        return self.projection.rect(pygame.Rect(self.mouse_pos[0] + sim.drag_offset[0] + 20,
+                                                self.mouse_pos[1] + sim.drag_offset[1] + 20, size, size))
+
+    def tooltip_panel(self):
+        return TEXT_CACHE.panel(self.small_font, self.sim.hovered_slot.get('desc', ''), WHITE, DARK_GRAY, WHITE)
+
+    def tooltip_rect(self):
+        w, h = self.tooltip_panel().get_size()
+        x, y = self.projection.point((self.mouse_pos[0] + 10, self.mouse_pos[1] + 10))
+        return pygame.Rect(x, y, w, h)
+
+    def message_surface(self):
+        return text_surface(self.font, self.sim.message, YELLOW)
+
+    def message_rect(self):
+        w, h = self.message_surface().get_size()
+        margin = self.projection.length(10)
+        return pygame.Rect(self.screen.get_width() - w - margin, margin, w, h)
+
+    def render_elements(self):
+        # Everything drawn this frame as key -> (rect, state) for the dirty renderer
+        sim = self.sim
+        elements = {}
+        for obj in self.room_objects():
+            elements[obj] = (pygame.Rect(self.projection.rect(obj.bounds())), obj.render_state())
+        if self.lighting and self.lighting.maps:
+            elements.update(self.lighting.elements())
+        elements['inventory'] = (self.inventory_rect(), (sim.inventory.version, ASSETS.generation))
+        if sim.dragging_item:
+            elements['drag'] = (self.drag_preview_rect(), sim.dragging_item['name'])
+        if sim.hovered_slot:
+            elements['tooltip'] = (self.tooltip_rect(), sim.hovered_slot.get('desc', ''))
+        for tween in self.tweens:
+            elements[tween] = (pygame.Rect(self.projection.rect(tween.rect)), (tween.size, tween.alpha))
+        if sim.message:
+            elements['message'] = (self.message_rect(), sim.message)
+        prof = self.profiler
+        if prof and prof.hud:
+            elements['hud'] = (prof.hud_rect(self.hud_font), prof.hud_lines)
+        if self.memory_lines is not None:
+            elements['memory'] = (self.memory_rect(), self.memory_lines)
+        return elements
+
+    def draw_object(self, obj):
+        if isinstance(obj, KeyPad):
+            obj.draw(self.screen, self.font, self.projection)
+        else:
+            obj.draw(self.screen, self.projection)
+
+    def draw_scene(self):
+        sim = self.sim
+        prof = self.profiler
+        if prof: prof.mark()
+        if STATIC_LAYER:
+            self.screen.blit(self.static_layer(), (0,0))
+            statics = sim.room.statics
+        else:
+            self.draw_background(self.screen)
+            statics = ()
+        if prof: prof.lap("background")
+
+        # Draw room objects in layer order; baked ones only need their live parts
+        for obj in self.room_objects():
+            if obj not in statics:
+                self.draw_object(obj)
+            elif isinstance(obj, KeyPad):
+                obj.draw_buttons(self.screen, self.projection)
+        if prof: prof.lap("room")
+        if self.lighting:
+            self.screen.blit(self.lighting.surface, (0,0), special_flags=pygame.BLEND_MULT)
+            if prof: prof.lap("lighting")
+
+        # Inventory
+        self.draw_inventory()
+        if sim.dragging_item:
+            drag_rect = self.drag_preview_rect()
+            try:
+                self.screen.blit(scaled(self.icon_image(sim.dragging_item.get('icon')), drag_rect.size), drag_rect)
+            except Exception:
+                pygame.draw.rect(self.screen, YELLOW, drag_rect)
+
+        if sim.hovered_slot:
+            self.screen.blit(self.tooltip_panel(), self.tooltip_rect())
+        if prof: prof.lap("inventory")
+
+        self.tweens.draw(self.screen, self.projection)
+        if prof: prof.lap("animations")
+        self.draw_transition()
+        if prof: prof.lap("transition")
+
+        if sim.message:
+            self.screen.blit(self.message_surface(), self.message_rect())
+        if prof: prof.lap("message")
+
+        if prof and prof.hud:
+            prof.draw_hud(self.screen, self.hud_font)
+            prof.lap("hud")
+        if self.memory_lines is not None:
+            self.draw_memory()
+
+    def hold_lighting(self):
+        return False
+
+    def render(self, alpha):
+        # Draw moving objects part-way between their last two simulated positions
+        saved = []
+        for obj, (px, py) in self.sim.prev_positions.items():
+            saved.append((obj, obj.rect.topleft))
+            obj.rect.topleft = (round(px + (obj.rect.x - px) * alpha), round(py + (obj.rect.y - py) * alpha))
+
+        self.frame_ticks = self.time_source()
+        # Finished tweens are dropped before drawing, so their last rect
+        # gets cleaned up by the dirty renderer
+        self.tweens.update(self.frame_ticks)
+
+        # Transitions repaint the whole screen; otherwise only what changed
+        if self.sim.transitioning():
+            self.transition_progress = self.sim.transition_progress(alpha * SIM_DT)
+        elif self.compositor.active:
+            self.compositor.end()
+        full = not DIRTY_RENDERING or self.compositor.active
+        if self.lighting:
+            self.lighting.update(self.frame_ticks, self.mouse_pos, self.sim.scene.lighting(self.sim.current_room),
+                                 hold=self.hold_lighting())
+        self.renderer.render(self.screen, self.render_elements(), self.draw_scene, full=full)
+        if self.profiler: self.profiler.lap("present")
+
+        for obj, pos in saved:
+            obj.rect.topleft = pos
+
+# ---------------- Memory Ledger ----------------
+# Byte counts for everything the game keeps resident: each texture and the
+# scaled copies made from it, the text and light caches, the view's own
+# surfaces and the sound bank. Pixels count as pitch x height, a sound as its
+# decoded length in the mixer's format. The asset bundle is memory-mapped and
+# music is streamed from disk, so both are listed but left out of the total.
+# --memory-report prints the ledger for every room; F4 shows it in game.
+MEMORY_OVERLAY_REFRESH = 30     # frames between overlay updates
+
+def sound_bytes(sound):
+    init = pygame.mixer.get_init()
+    if not init:
+        return 0
+    freq, fmt, channels = init
+    return int(sound.get_length() * freq) * channels * (abs(fmt) // 8)
+
+def memory_ledger(view=None):
+    # (group, name, bytes, counted) rows
+    rows = []
+    scaled_by_source = {}
+    for _, source, nbytes in SCALE_CACHE.entries.values():
+        scaled_by_source[id(source)] = scaled_by_source.get(id(source), 0) + nbytes
+    for name, surf in sorted(ASSETS.surfaces.items()):
+        rows.append(("texture", name, surface_bytes(surf), True))
+        nbytes = scaled_by_source.pop(id(surf), 0)
+        if nbytes:
+            rows.append(("scaled", name, nbytes, True))
+    if scaled_by_source:
+        rows.append(("scaled", "(untextured)", sum(scaled_by_source.values()), True))
+    rows.append(("cache", "text", sum(surface_bytes(surf) for surf in TEXT_CACHE.entries.values()), True))
+    rows.append(("cache", "glyph atlases", sum(surface_bytes(a.sheet) for a in TEXT_CACHE.atlases.values()), True))
+    rows.append(("cache", "light maps", sum(maps.nbytes() for maps in LIGHT_CACHE.values()), True))
+    if view is not None:
+        rows.extend(view.memory_rows())
+    for name, sound in sorted(AUDIO.bank.items()):
+        rows.append(("sound", name, sound_bytes(sound), True))
+    if AUDIO.track:
+        try:
+            rows.append(("music", AUDIO.track + " (streamed)", os.path.getsize(AUDIO.music_paths[AUDIO.track]), False))
+        except OSError:
+            pass
+    bundle = ASSETS.bundle
+    if bundle is not None and bundle.mm is not None:
+        rows.append(("bundle", os.path.basename(bundle.path) + " (mapped)", len(bundle.mm), False))
+    return rows
+
+def memory_totals(rows):
+    totals = {}
+    for group, _, nbytes, counted in rows:
+        if counted:
+            totals[group] = totals.get(group, 0) + nbytes
+    return totals
+
+def budget_line():
+    used = ASSETS.resident_bytes() + SCALE_CACHE.bytes_used
+    if ASSETS.budget is None:
+        return f"textures+scaled {used / 1024:.0f} KiB, no budget"
+    return (f"textures+scaled {used / 1024:.0f} of {ASSETS.budget / 1024:.0f} KiB budget, "
+            f"{ASSETS.budget_evictions} evicted")
+
+def memory_report(rows):
+    lines = [f"{'group':8s} {'name':28s} {'KiB':>9s}"]
+    for group, name, nbytes, counted in rows:
+        lines.append(f"{group:8s} {name:28s} {nbytes / 1024:9.1f}" + ("" if counted else "  (not counted)"))
+    totals = memory_totals(rows)
+    lines.append("  ".join(f"{group} {nbytes / 1024:.0f}" for group, nbytes in totals.items()) + " KiB")
+    lines.append(f"total {sum(totals.values()) / 1024:.0f} KiB; {budget_line()}")
+    return "\n".join(lines)
+
+def run_memory_report():
+    # Walk through every room the way the game would and print what is resident in each
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.init()
+    # textures get the same display formats as in game
+    pygame.display.set_mode((1, 1))
+    scene = get_scene()
+    ASSETS.use_scene(scene)
+    ASSETS.use_render_size(RENDER_SIZE)
+    ASSETS.open_bundle()
+    AUDIO.start()
+    deadline = time.perf_counter() + 5.0
+    while AUDIO.enabled and len(AUDIO.bank) + len(AUDIO.failed) < len(AUDIO.sound_paths):
+        if time.perf_counter() > deadline:
+            break
+        time.sleep(0.01)
+        AUDIO.pump()
+
+    sim = Simulation(scene)
+    view = SceneView(sim, pygame.Surface(RENDER_SIZE), projection=Projection(RENDER_SIZE))
+    if LIGHTING and numpy is not None:
+        view.lighting = Lighting(RENDER_SIZE, view.projection)
+    for room_id in sorted(scene.rooms):
+        if room_id != sim.current_room:
+            sim.enter_room(room_id)
+        ASSETS.enter_room(room_id)
+        # current room first, then the preloads, in the order the loader takes them
+        ASSETS.load_now(ASSETS.shared + ASSETS.room_assets.get(room_id, ()))
+        for other in ASSETS.neighbours.get(room_id, ()):
+            ASSETS.load_now(ASSETS.room_assets.get(other, ()))
+        AUDIO.play_music(scene.music(room_id))
+        view.render(1.0)
+        print(f"Room {room_id}")
+        print(memory_report(memory_ledger(view)))
+        print()
+
+# ---------------- Game ----------------
+class Game(SceneView):
+    def __init__(self, sim=None, profiler=None, recorder=None, replay=None, save_path=None, capture=None):
+        pygame.init()
+        AUDIO.start()
+
+        if FULLSCREEN:
+            self.display = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        else:
+            self.display = pygame.display.set_mode(DISPLAY_SIZE)
+        pygame.display.set_caption("Dungeon of Whispers")
+        window = self.display.get_size()
+        if window == RENDER_SIZE:
+            screen, present = self.display, present_display
+        else:
+            screen, present = pygame.Surface(RENDER_SIZE).convert(), self.present_scaled
+        self.window_projection = Projection(window, RENDER_SIZE)
+        super().__init__(sim if sim is not None else Simulation(), screen,
+                         projection=Projection(RENDER_SIZE), present=present)
+        self.clock = pygame.time.Clock()
+        self.profiler = profiler
+        self.recorder = recorder
+        self.replay = replay
+        self.capture = capture
+
+        ASSETS.use_scene(self.sim.scene)
+        ASSETS.use_render_size(RENDER_SIZE)
+        ASSETS.start()
+        ASSETS.enter_room(self.sim.current_room)
+        self.loaded_room = None
+        AUDIO.play_music(self.sim.scene.music(self.sim.current_room))
+
+        # input collected since the last simulation tick
+        self.pending = Inputs()
+        self.accumulator = 0.0
+        self.frame_dt = SIM_DT
+
+        self.governor = FrameGovernor()
+        self.idle_sleeps = 0
+
+        if LIGHTING and numpy is not None:
+            self.lighting = Lighting(self.screen.get_size(), self.projection)
+
+        self.input = InputLayer(Projection((WINDOW_WIDTH, WINDOW_HEIGHT), window).point)
+        self.input.install()
+        self.input.bind_key(pygame.K_F3, self.toggle_profiler_hud)
+        self.input.bind_key(pygame.K_F4, self.toggle_memory_overlay)
+        self.memory_refresh = 0
+        self.input.expose_callback = self.renderer.invalidate
+
+        # saves; quick-load would desync a recording, so it is off while one runs
+        self.saver = SaveWriter(save_path) if save_path else None
+        self.saved_revision = self.sim.revision
+        self.last_autosave = self.sim.time
+        if self.saver:
+            self.input.bind_key(pygame.K_F5, self.save_now)
+            if not recorder and not replay:
+                self.input.bind_key(pygame.K_F9, self.load_game)
+
+    def reset(self, sim):
+        self.sim = sim
+        AUDIO.play_music(sim.scene.music(sim.current_room))
+        self.saved_revision = sim.revision
+        self.last_autosave = sim.time
+        self.tweens.clear()
+        self.pending = Inputs()
+        self.accumulator = 0.0
+        self.loaded_room = None
+        self.compositor.end()
+        self.renderer.invalidate()
+
+    def handle_sim_events(self):
+        for event in self.sim.drain_events():
+            kind = event[0]
+            if kind == 'pickup':
+                _, texture, color, size, pos, slot_index = event
+                image = self.item_image(texture, color, size)
+                if image:
+                    self.start_pickup_animation(image, pos, slot_index)
+            elif kind == 'use':
+                _, icon, pos = event
+                image = self.icon_image(icon)
+                if image:
+                    self.start_use_animation(image, pos, pos, duration_ms=600)
+            elif kind == 'transition':
+                # the screen still holds the old room's last frame
+                self.compositor.begin(self.screen)
+                AUDIO.play_music(self.sim.scene.music(event[2]))
+            elif kind == 'sound':
+                AUDIO.play(event[1])
+
+    def present_scaled(self, rects):
+        # The one upscale of the frame; rects are in render-target pixels
+        scale = pygame.transform.smoothscale if SMOOTH_UPSCALE else pygame.transform.scale
+        scale(self.screen, self.display.get_size(), self.display)
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update([self.window_projection.rect(r).inflate(2, 2) for r in rects])
+
+    def draw_loading(self):
+        done, total = ASSETS.progress(self.sim.current_room)
+        self.screen.fill(BLACK)
+        atlas = TEXT_CACHE.atlas(self.font, WHITE)
+        text = f"Loading... {done}/{total}"
+        w, h = atlas.size(text)
+        width, height = self.screen.get_size()
+        atlas.draw(self.screen, text, (width // 2 - w // 2, height // 2 - h // 2))
+        self.present(None)
+
+    def update_assets(self):
+        # Returns True once everything the current room needs is resident
+        ASSETS.pump(1 if self.governor.late() else None)
+        room = self.sim.current_room
+        if ASSETS.current_room != room:
+            ASSETS.enter_room(room)
+        if not ASSETS.room_ready(room):
+            self.loaded_room = None
+            return False
+        if self.loaded_room != room:
+            self.loaded_room = room
+            for keypad in self.sim.room.keypads:
+                keypad.prebake(self.projection)
+            if PIXEL_PERFECT_HITS:
+                self.prepare_hit_masks()
+            self.renderer.invalidate()
+        return True
+
+    def prepare_hit_masks(self):
+        for obj in self.sim.room.objects:
+            if isinstance(obj, KeyPad):
+                continue
+            for name in obj.texture_names():
+                build_hit_mask(name, obj.rect.size)
+
+    def advance(self, inputs):
+        # One simulation tick plus a rendered frame, for scripted drivers
+        # (benchmarks, replays) that run without the real-time loop
+        while not self.update_assets():
+            ASSETS.pump()
+            time.sleep(0.001)
+        self.mouse_pos = inputs.mouse_pos
+        self.sim.step(SIM_DT, inputs)
+        self.handle_sim_events()
+        self.render(1.0)
+        if self.capture:
+            self.capture.capture(self.screen, block=True)
+
+    def toggle_profiler_hud(self):
+        if self.profiler is None:
+            self.profiler = FrameProfiler()
+        self.profiler.hud = not self.profiler.hud
+        self.profiler.hud_lines = self.profiler.summary_lines()
+        self.renderer.invalidate()
+
+    def toggle_memory_overlay(self):
+        if self.memory_lines is None:
+            self.refresh_memory_overlay()
+            self.memory_refresh = MEMORY_OVERLAY_REFRESH
+        else:
+            self.memory_lines = None
+        self.renderer.invalidate()
+
+    def memory_rows(self):
+        rows = super().memory_rows()
+        if self.display is not self.screen:
+            rows.append(("view", "window", surface_bytes(self.display), True))
+        return rows
+
+    def is_idle(self):
+        return (IDLE_SLEEP and not self.replay and not self.tweens and not self.compositor.active
+                and not self.pending.events and not self.pending.mouse_pressed
+                and not (self.profiler and self.profiler.hud) and not ASSETS.busy()
+                and not AUDIO.fading()
+                and not (self.lighting and self.lighting.pending(self.mouse_pos))
+                and self.sim.idle())
+
+    def hold_lighting(self):
+        return self.governor.late()
+
+    def sleep_until_input(self):
+        # Block until input arrives or the message is due to disappear
+        if self.sim.message_timer > 0:
+            pygame.time.set_timer(IDLE_WAKE_EVENT, int(self.sim.message_timer * 1000) + 1)
+        start = time.perf_counter()
+        event = pygame.event.wait()
+        pygame.time.set_timer(IDLE_WAKE_EVENT, 0)
+        if event.type != IDLE_WAKE_EVENT:
+            pygame.event.post(event)  # handled by the normal loop
+        self.accumulator += time.perf_counter() - start
+        ticks = int(self.accumulator / SIM_DT)
+        self.sim.skip_idle_ticks(ticks, SIM_DT)
+        self.accumulator -= ticks * SIM_DT
+        # the sleep is accounted for; don't let the frame clock count it again
+        self.clock.tick()
+        self.frame_dt = 0.0
+        self.idle_sleeps += 1
+
+    def save_now(self):
+        self.saver.submit(self.sim.snapshot())
+        self.saved_revision = self.sim.revision
+        self.last_autosave = self.sim.time
+
+    def autosave(self):
+        sim = self.sim
+        if (self.saver and sim.revision != self.saved_revision and not sim.dragging_item
+                and not sim.transitioning() and sim.time - self.last_autosave >= AUTOSAVE_INTERVAL):
+            self.save_now()
+
+    def load_game(self):
+        # Straight into the saved room; assets of rooms already resident stay loaded
+        self.saver.flush()
+        try:
+            sim = load_save(self.saver.path, self.sim.scene)
+        except (OSError, ValueError) as e:
+            self.sim.show_message("No saved game to load." if isinstance(e, OSError)
+                                  else "The saved game is damaged.")
+            print(f"Failed to load {self.saver.path}: {e}")
+            return
+        self.reset(sim)
+        sim.show_message("Game loaded.")
+
+    def finish_capture(self):
+        self.capture.close()
+        print(self.capture.report())
+
+    def quit(self):
+        if self.saver:
+            if self.sim.revision != self.saved_revision:
+                self.save_now()
+            self.saver.flush()
+        if self.recorder:
+            self.recorder.record_quit(self.sim.tick)
+            self.recorder.close()
+        if self.capture:
+            self.finish_capture()
+        if self.profiler:
+            self.profiler.close()
+        pygame.quit()
+        sys.exit()
+
+    # ---------------- Main Loop ----------------
+    def run(self):
+        while True:
+            AUDIO.update()
+            if not self.update_assets():
+                # Keep the window responsive, but hold the game until the room is in
+                if self.input.poll().quit:
+                    self.quit()
+                self.draw_loading()
+                self.clock.tick(FPS)
+                self.frame_dt = SIM_DT
+                continue
+
+            if self.is_idle() and not pygame.event.peek():
+                self.sleep_until_input()
+
+            governor = self.governor
+            governor.begin()
+            prof = self.profiler
+            if prof: prof.mark()
+            frame = self.input.poll()
+            if frame.quit:
+                self.quit()
+            prof = self.profiler  # F3 may have just created one
+            if not self.replay:  # otherwise the recording drives the mouse
+                self.pending.events.extend(frame.events)
+            self.mouse_pos = frame.mouse_pos
+            self.pending.mouse_pos = frame.mouse_pos
+            self.pending.mouse_pressed = frame.mouse_pressed
+            if prof: prof.lap("events")
+
+            # Fixed-timestep simulation; input is handed to the first tick only
+            self.accumulator += min(self.frame_dt, MAX_FRAME_DT)
+            while self.accumulator >= SIM_DT:
+                inputs = self.pending
+                if self.replay:
+                    inputs = self.replay.next_inputs()
+                    if inputs is None:
+                        self.quit()
+                    self.mouse_pos = inputs.mouse_pos
+                elif self.recorder:
+                    self.recorder.record(self.sim.tick, inputs)
+                self.sim.step(SIM_DT, inputs)
+                self.pending = Inputs(self.pending.mouse_pos, self.pending.mouse_pressed)
+                self.accumulator -= SIM_DT
+            self.handle_sim_events()
+            self.autosave()
+            if prof: prof.lap("sim")
+
+            if self.memory_lines is not None:
+                self.memory_refresh -= 1
+                if self.memory_refresh <= 0:
+                    self.refresh_memory_overlay()
+                    self.memory_refresh = MEMORY_OVERLAY_REFRESH
+            rendered = governor.should_render()
+            if rendered:
+                self.render(self.accumulator / SIM_DT)
+                # skipped frames would only repeat the last one
+                if self.capture:
+                    self.capture.capture(self.screen)
+            governor.end(rendered)
+            self.frame_dt = self.clock.tick(FPS) / 1000.0
+            if prof:
+                prof.lap("tick")
+                prof.end_frame(refresh_hud=not governor.late())
+
+# ---------------- Scripted Input ----------------
+# Scripts are lists of steps that expand into one Inputs per simulation tick:
+#   ("click", pos)              press and release at pos
+#   ("drag", start, end, ticks) press at start, move over `ticks`, release
+#   ("drag", start, end, ticks, hold)   ... and keep holding for `hold` ticks first
+#   ("wait", ticks)             idle ticks
+#   ("settle",)                 idle until transitions and dropping objects stop
+# A position may be a callable taking the simulation, resolved when reached.
+SETTLE_LIMIT = 600
+
+def resolve_pos(pos, sim):
+    return tuple(pos(sim)) if callable(pos) else tuple(pos)
+
+def script_inputs(sim, steps):
+    pos = (0, 0)
+    for step in steps:
+        kind = step[0]
+        if kind == "click":
+            pos = resolve_pos(step[1], sim)
+            yield Inputs(pos, True, [('move', pos), ('down', pos)])
+            yield Inputs(pos, False, [('up', pos)])
+        elif kind == "drag":
+            start, end, ticks = resolve_pos(step[1], sim), resolve_pos(step[2], sim), step[3]
+            yield Inputs(start, True, [('move', start), ('down', start)])
+            for i in range(1, ticks + 1):
+                pos = (start[0] + (end[0] - start[0]) * i // ticks, start[1] + (end[1] - start[1]) * i // ticks)
+                yield Inputs(pos, True, [('move', pos)])
+            for _ in range(step[4] if len(step) > 4 else 0):
+                yield Inputs(pos, True)
+            yield Inputs(pos, False, [('up', pos)])
+        elif kind == "wait":
+            for _ in range(step[1]):
+                yield Inputs(pos, False)
+        elif kind == "settle":
+            for _ in range(SETTLE_LIMIT):
+                if sim.settled():
+                    break
+                yield Inputs(pos, False)
+        else:
+            raise ValueError(f"Unknown script step {kind!r}")
+
+def keypad_button(index, keypad_id="keypad"):
+    return lambda sim: sim.obj(keypad_id).buttons[index]['rect'].center
+
+def keypad_code_steps(code, keypad_id="keypad", clear=0):
+    # digits 1-9 are buttons 0-8, backspace is 9, 0 is 10, enter is 11
+    steps = [("click", keypad_button(9, keypad_id))] * clear
+    steps += [("click", keypad_button(10 if d == "0" else int(d) - 1, keypad_id)) for d in code]
+    steps.append(("click", keypad_button(11, keypad_id)))
+    return steps
+
+def rope_under_chest_steps():
+    # grabbing the chest by its centre keeps that centre under the cursor
+    return [("drag", lambda sim: sim.obj("chest").rect.center,
+             lambda sim: (sim.obj("rope").rect.centerx, sim.obj("chest").rect.centery), 30),
+            ("wait", 20)]
+
+def fragment_steps():
+    return [("click", lambda sim, name=name: sim.obj(name).rect.center)
+            for name in ("vase_frag1", "vase_frag2", "vase_frag3")]
+
+# ---------------- Input Recording ----------------
+# Inputs are captured per simulation tick, so feeding them back into a fresh
+# Simulation reproduces a session exactly, at real speed or flat out.
+# File: header, then fixed-size records. A mouse-state record is written only
+# on ticks where the cursor position or button state changed.
+INPUT_MAGIC = b"DWIR"
+INPUT_VERSION = 1
+INPUT_HEADER = struct.Struct("<4sHH")    # magic, version, ticks per second
+INPUT_RECORD = struct.Struct("<IIBhh")   # tick, ms since recording started, kind, x, y
+(INPUT_STATE_UP, INPUT_STATE_DOWN, INPUT_DOWN, INPUT_UP, INPUT_MOVE, INPUT_QUIT) = range(6)
+INPUT_EVENT_KINDS = {'down': INPUT_DOWN, 'up': INPUT_UP, 'move': INPUT_MOVE}
+INPUT_EVENT_NAMES = {v: k for k, v in INPUT_EVENT_KINDS.items()}
+
+class InputRecorder:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, round(1 / SIM_DT)))
+        self.start = time.perf_counter()
+        self.last_state = None
+
+    def write(self, tick, kind, pos):
+        ms = int((time.perf_counter() - self.start) * 1000)
+        self.file.write(INPUT_RECORD.pack(tick, ms, kind, pos[0], pos[1]))
+
+    def record(self, tick, inputs):
+        state = (tuple(inputs.mouse_pos), bool(inputs.mouse_pressed))
+        if state != self.last_state:
+            self.last_state = state
+            self.write(tick, INPUT_STATE_DOWN if state[1] else INPUT_STATE_UP, state[0])
+        for kind, pos in inputs.events:
+            self.write(tick, INPUT_EVENT_KINDS[kind], pos)
+
+    def record_quit(self, tick):
+        self.write(tick, INPUT_QUIT, (0, 0))
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class InputReplay:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, rate = INPUT_HEADER.unpack_from(data, 0)
+        if magic != INPUT_MAGIC or version != INPUT_VERSION:
+            raise ValueError(f"{path} is not an input recording")
+        if rate != round(1 / SIM_DT):
+            raise ValueError(f"{path} was recorded at {rate} ticks/s, the game runs at {round(1 / SIM_DT)}")
+        body = data[INPUT_HEADER.size:]
+        # a session that crashed mid-write leaves a partial last record
+        body = body[:len(body) - len(body) % INPUT_RECORD.size]
+        self.records = list(INPUT_RECORD.iter_unpack(body))
+        self.index = 0
+        self.tick = 0
+        self.mouse_pos = (0, 0)
+        self.mouse_pressed = False
+
+    def next_inputs(self):
+        # Inputs for the next tick, or None once the recording is over
+        records = self.records
+        if self.index >= len(records):
+            return None
+        events = []
+        while self.index < len(records) and records[self.index][0] == self.tick:
+            _, _, kind, x, y = records[self.index]
+            self.index += 1
+            if kind == INPUT_QUIT:
+                self.index = len(records)
+                return None
+            if kind in (INPUT_STATE_UP, INPUT_STATE_DOWN):
+                self.mouse_pos = (x, y)
+                self.mouse_pressed = kind == INPUT_STATE_DOWN
+            else:
+                events.append((INPUT_EVENT_NAMES[kind], (x, y)))
+        self.tick += 1
+        return Inputs(self.mouse_pos, self.mouse_pressed, events)
+
+def replay_fast(path, render=True, capture=None):
+    # Feed a recording through as fast as possible, optionally without a
+    # window; with a capture every tick's frame is exported
+    replay = InputReplay(path)
+    start = time.perf_counter()
+    if render:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        game = Game(replay=replay, capture=capture)
+        game.time_source = lambda: int(game.sim.time * 1000)
+        sim = game.sim
+        inputs = replay.next_inputs()
+        while inputs is not None:
+            game.advance(inputs)
+            inputs = replay.next_inputs()
+        if capture:
+            game.finish_capture()
+    else:
+        sim = Simulation()
+        inputs = replay.next_inputs()
+        while inputs is not None:
+            sim.step(SIM_DT, inputs)
+            inputs = replay.next_inputs()
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {sim.tick} ticks ({sim.tick * SIM_DT:.1f}s of play) in {elapsed:.3f}s")
+    print(f"Final state: room {sim.current_room}, message {sim.message!r}")
+    return sim
+
+# ---------------- Save Games ----------------
+# A save holds only game state: the room, the inventory, flags and every
+# object that differs from its spec in rooms.json, as compact JSON after a
+# small header and zlib. The autosave snapshot is taken on the main thread
+# (plain dicts, no surfaces), and encoding and writing happen on a
+# background thread. Files are replaced atomically, so a crash mid-write
+# leaves the previous save intact.
+SAVE_PATH = os.path.join(BASE_DIR, "savegame.dat")
+SAVE_MAGIC = b"DWSV"
+SAVE_VERSION = 1
+SAVE_HEADER = struct.Struct("<4sH")    # magic, version
+AUTOSAVE_INTERVAL = 2.0                # min seconds of play between autosaves
+
+def encode_save(snapshot):
+    body = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+    return SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION) + zlib.compress(body)
+
+def decode_save(data, path="save"):
+    if len(data) < SAVE_HEADER.size:
+        raise ValueError(f"{path} is not a save game")
+    magic, version = SAVE_HEADER.unpack_from(data, 0)
+    if magic != SAVE_MAGIC:
+        raise ValueError(f"{path} is not a save game")
+    if version != SAVE_VERSION:
+        raise ValueError(f"{path} is save version {version}, this game reads {SAVE_VERSION}")
+    try:
+        body = zlib.decompress(data[SAVE_HEADER.size:])
+    except zlib.error as e:
+        raise ValueError(f"{path} is corrupt: {e}")
+    return json.loads(body.decode("utf-8"))
+
+def write_save(path, snapshot):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode_save(snapshot))
+    os.replace(tmp, path)
+
+def load_save(path, scene=None):
+    with open(path, "rb") as f:
+        return Simulation.from_snapshot(decode_save(f.read(), path), scene)
+
+class SaveWriter:
+    # Only the newest pending snapshot is written; older ones are dropped
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.writes = 0
+        self.thread = threading.Thread(target=self.work, name="save-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, snapshot):
+        with self.lock:
+            self.pending = snapshot
+            self.idle.clear()
+        self.wake.set()
+
+    def work(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.lock:
+                snapshot, self.pending = self.pending, None
+            if snapshot is not None:
+                try:
+                    write_save(self.path, snapshot)
+                    self.writes += 1
+                except OSError as e:
+                    print(f"Failed to write save {self.path}: {e}")
+            with self.lock:
+                if self.pending is None:
+                    self.idle.set()
+
+    def flush(self, timeout=5.0):
+        self.idle.wait(timeout)
+
+# ---------------- Benchmarks ----------------
+# Replays scripted scenarios under SDL's dummy video/audio drivers and reports
+# frame times and Python allocations per room. tracemalloc only sees Python
+# allocations (not SDL pixel buffers), and it slows frames down, so
+# allocations are measured in a second, untimed pass. Each scenario is timed
+# BENCH_REPEATS times and every statistic is the median over the repeats. The
+# baseline gate compares the main thread's CPU time (cpu95) rather than wall
+# time, which moves with whatever else the machine is doing.
+def open_door(door):
+    door.is_open = True
+
+def hide(item):
+    item.is_collected = True
+
+def setup_room2(sim):
+    sim.with_object(1, "door", open_door)
+    sim.enter_room(2)
+
+def setup_rope_down(sim):
+    sim.with_object(1, "key", hide)
+    sim.with_object(1, "door", open_door)
+    sim.with_object(1, "rope", lambda rope: rope.start_drop(instant=True))
+
+def setup_room3(sim):
+    sim.enter_room(3)
+
+BENCH_SCENARIOS = {
+    "keypad": (setup_room2, keypad_code_steps("25167") + [("wait", 60)]),
+    "chest_to_rope": (setup_rope_down, rope_under_chest_steps()
+                      + [("click", lambda sim: sim.obj("rope").rect.center), ("settle",), ("wait", 30)]),
+    "room3_fragments": (setup_room3, fragment_steps() + [("wait", 60)]),
+    "playthrough": (None, [
+        ("click", lambda sim: sim.obj("key").rect.center), ("wait", 10),
+        ("click", lambda sim: sim.obj("door").rect.center), ("wait", 10),
+        ("click", lambda sim: sim.obj("door").rect.center), ("settle",),
+    ] + keypad_code_steps("25167") + [
+        ("click", lambda sim: sim.obj("door").rect.center), ("settle",), ("settle",),
+    ] + rope_under_chest_steps() + [
+        ("click", lambda sim: sim.obj("rope").rect.center), ("settle",),
+    ] + fragment_steps() + [("wait", 60)]),
+}
+BENCH_NOISE_MS = 0.5   # p95 differences below this are never regressions
+BENCH_REPEATS = 9
+BENCH_TOLERANCE = 0.3
+
+def run_scenario(game, name, measure_alloc=False):
+    setup, steps = BENCH_SCENARIOS[name]
+    sim = Simulation()
+    if setup:
+        setup(sim)
+    game.reset(sim)
+    game.time_source = lambda: int(sim.time * 1000)
+    # every run starts with the loader settled, not just the first one after startup
+    ASSETS.enter_room(sim.current_room)
+    while ASSETS.busy():
+        ASSETS.pump()
+        time.sleep(0.001)
+    per_room = {}
+    for inputs in script_inputs(sim, steps):
+        room = sim.current_room
+        if measure_alloc:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            game.advance(inputs)
+            value = tracemalloc.get_traced_memory()[1] - before
+        else:
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            game.advance(inputs)
+            value = ((time.perf_counter() - start) * 1000.0, (time.thread_time() - cpu_start) * 1000.0)
+        per_room.setdefault(room, []).append(value)
+    return per_room
+
+def summarize(values):
+    values = sorted(values)
+    last = len(values) - 1
+    return {
+        "frames": len(values),
+        "mean": sum(values) / len(values),
+        "p50": values[int(last * 0.50)],
+        "p95": values[int(last * 0.95)],
+        "p99": values[int(last * 0.99)],
+        "max": values[-1],
+    }
+
+def median_stats(runs):
+    stats = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    stats["frames"] = sum(run["frames"] for run in runs)
+    return stats
+
+def run_benchmarks(names=None, baseline_path=None, save_path=None, tolerance=BENCH_TOLERANCE, repeats=BENCH_REPEATS):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    game = Game()
+    names = names or list(BENCH_SCENARIOS)
+    results = {}
+    for name in names:
+        runs = {}
+        for _ in range(max(1, repeats)):
+            for room, values in run_scenario(game, name).items():
+                stats = summarize([wall for wall, _ in values])
+                stats["cpu_p95"] = summarize([cpu for _, cpu in values])["p95"]
+                runs.setdefault(room, []).append(stats)
+        tracemalloc.start()
+        allocs = run_scenario(game, name, measure_alloc=True)
+        tracemalloc.stop()
+        results[name] = {}
+        for room, room_runs in sorted(runs.items()):
+            stats = median_stats(room_runs)
+            stats["alloc_kib"] = sum(allocs.get(room, [0])) / max(1, len(allocs.get(room, []))) / 1024.0
+            results[name][str(room)] = stats
+
+    print(f"{'scenario':16s} {'room':>4s} {'frames':>6s} {'mean':>7s} {'p50':>7s} {'p95':>7s} {'p99':>7s} {'max':>7s} "
+          f"{'cpu95':>7s} {'KiB/f':>7s}")
+    for name, rooms in results.items():
+        for room, st in rooms.items():
+            print(f"{name:16s} {room:>4s} {st['frames']:6d} {st['mean']:7.3f} {st['p50']:7.3f} "
+                  f"{st['p95']:7.3f} {st['p99']:7.3f} {st['max']:7.3f} {st['cpu_p95']:7.3f} {st['alloc_kib']:7.1f}")
+
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for name, rooms in results.items():
+            for room, st in rooms.items():
+                base = baseline.get(name, {}).get(room)
+                if base is None:
+                    continue
+                # older baselines only have wall-clock p95
+                key = "cpu_p95" if "cpu_p95" in base else "p95"
+                limit = base[key] * (1.0 + tolerance)
+                if st[key] > limit and st[key] - base[key] > BENCH_NOISE_MS:
+                    regressions.append(f"{name} room {room}: {key} {st[key]:.3f} ms > {limit:.3f} ms (baseline {base[key]:.3f})")
+        for line in regressions:
+            print("REGRESSION", line)
+        if not regressions:
+            print("No regressions against", baseline_path)
+
+    pygame.quit()
+    return not regressions
+
+# ---------------- Puzzle Explorer ----------------
+# Breadth-first search over everything a player can do, run on the real
+# Simulation: each state is a save snapshot, and each move is a short input
+# script followed by ("settle",). The moves tried from a state are clicking
+# whatever can be clicked, dragging draggables home, under whatever needs
+# them and in front of doors they block, typing each trigger code on a
+# keypad and dropping each inventory item. Every BFS level is expanded
+# across a process pool. The report gives the shortest solution for each
+# goal in rooms.json, the goals that can't be reached, and dead ends:
+# reachable states from which the last goal can no longer be reached.
+EXPLORE_MAX_STATES = 20000
+EXPLORE_DRAG_TICKS = 10
+EXPLORE_DRAG_HOLD = 20       # lets a dragged box catch up with the cursor
+EXPLORE_SHOWN_DEAD_ENDS = 3
+
+def explore_key(sim):
+    state = sim.snapshot()
+    state["tick"] = 0
+    state["time"] = 0.0
+    return json.dumps(state, sort_keys=True, separators=(",", ":"))
+
+def explore_actions(sim):
+    room = sim.room
+    actions = []
+    for obj in room.objects:
+        action = obj.props.get("action")
+        if getattr(obj, "is_collected", False):
+            continue
+        if action in ("pickup", "door", "climb"):
+            actions.append((f"click {obj.id}", [("click", obj.rect.center)]))
+        elif action == "drag":
+            home = pygame.Rect(sim.scene.spec(room.id, obj.id)["rect"]).centerx
+            targets = [("home", home)]
+            for other in room.objects:
+                if other.props.get("needs_under") == obj.id:
+                    targets.append((f"under {other.id}", other.rect.centerx))
+                if other.props.get("blocked_by") == obj.id:
+                    targets.append((f"in front of {other.id}", other.rect.centerx))
+            for name, x in targets:
+                actions.append((f"drag {obj.id} {name}",
+                                [("drag", obj.rect.center, (x, obj.rect.centery), EXPLORE_DRAG_TICKS, EXPLORE_DRAG_HOLD)]))
+        elif action == "keypad":
+            for trigger in sim.scene.triggers:
+                if (trigger["on"] == "keypad_code" and trigger.get("room", room.id) == room.id
+                        and trigger.get("object", obj.id) == obj.id):
+                    actions.append((f"enter {trigger['code']} on {obj.id}",
+                                    keypad_code_steps(trigger["code"], obj.id, clear=len(obj.input))))
+    for i, entry in enumerate(sim.inventory):
+        pos = sim.inventory.slot_center(i)
+        actions.append((f"drop {entry['name']}", [("drag", pos, pos, 1)]))
+    return [(f"room {room.id}: {label}", steps) for label, steps in actions]
+
+def explore_apply(key, steps, scene):
+    sim = Simulation.from_snapshot(json.loads(key), scene)
+    for inputs in script_inputs(sim, steps + [("settle",)]):
+        sim.step(SIM_DT, inputs)
+    return explore_key(sim)
+
+def explore_expand(keys):
+    # Runs in the pool workers; returns (parent, move, child) for every move
+    scene = get_scene()
+    moves = []
+    for key in keys:
+        for label, steps in explore_actions(Simulation.from_snapshot(json.loads(key), scene)):
+            moves.append((key, label, explore_apply(key, steps, scene)))
+    return moves
+
+def goal_reached(goal, key):
+    state = json.loads(key)
+    if "room" in goal and state["room"] != goal["room"]:
+        return False
+    names = {entry["name"] for entry in state["inventory"]}
+    if not names.issuperset(goal.get("items", ())):
+        return False
+    return all(state["flags"].get(flag) == value for flag, value in goal.get("flags", {}).items())
+
+def explore_path(parents, key):
+    path = []
+    while parents[key] is not None:
+        key, label = parents[key]
+        path.append(label)
+    return path[::-1]
+
+def run_explorer(workers=None, max_states=EXPLORE_MAX_STATES):
+    scene = get_scene()
+    workers = workers or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    start = explore_key(Simulation(scene))
+    parents = {start: None}
+    children = {}
+    frontier = [start]
+    depth = 0
+    with ProcessPoolExecutor(workers) as pool:
+        while frontier and len(parents) < max_states:
+            chunk = max(1, -(-len(frontier) // (workers * 4)))
+            batches = [frontier[i:i + chunk] for i in range(0, len(frontier), chunk)]
+            frontier = []
+            for moves in pool.map(explore_expand, batches):
+                for parent, label, child in moves:
+                    children.setdefault(parent, set()).add(child)
+                    if child not in parents:
+                        parents[child] = (parent, label)
+                        frontier.append(child)
+            depth += 1
+    elapsed = time.perf_counter() - start_time
+    complete = not frontier
+    moves = sum(len(c) for c in children.values())
+    print(f"Explored {len(parents)} states, {moves} distinct moves, depth {depth} "
+          f"in {elapsed:.2f}s on {workers} workers" + ("" if complete else " (stopped at the state limit)"))
+
+    ok = complete
+    final = None
+    for goal in scene.goals:
+        reached = [key for key in parents if goal_reached(goal, key)]
+        final = reached
+        if not reached:
+            print(f"goal {goal['name']!r}: UNREACHABLE")
+            ok = False
+            continue
+        # parents is in BFS discovery order, so the first hit is the closest
+        path = explore_path(parents, reached[0])
+        print(f"goal {goal['name']!r}: {len(path)} moves")
+        for i, label in enumerate(path, 1):
+            print(f"  {i:3d}. {label}")
+
+    if complete and final:
+        # Walk back from the states that satisfy the last goal
+        incoming = {}
+        for parent, kids in children.items():
+            for child in kids:
+                incoming.setdefault(child, []).append(parent)
+        alive = set(final)
+        stack = list(final)
+        while stack:
+            for parent in incoming.get(stack.pop(), ()):
+                if parent not in alive:
+                    alive.add(parent)
+                    stack.append(parent)
+        dead = [key for key in parents if key not in alive]
+        print(f"dead ends: {len(dead)}")
+        for key in dead[:EXPLORE_SHOWN_DEAD_ENDS]:
+            print("  " + " -> ".join(explore_path(parents, key)))
+        ok = ok and not dead
+    return ok
+
+# ---------------- Session Host ----------------
+# Many independent games in one process: one Simulation per client
+# connection, all stepped by a single asyncio task. The scene and every
+# texture are loaded once and shared read-only; all rooms stay resident,
+# since sessions are spread across them. Nothing is drawn unless a client
+# asks for a frame. A session's off-screen surface is made on its first
+# frame request and redrawn through the dirty renderer after that, so a
+# repeat request only repaints what changed. Encoding a frame happens on a
+# worker thread, off the event loop.
+# Protocol: one JSON request per line over a local socket, one session per
+# connection.
+#   {"op": "input", "events": [["down", [x, y]], ...], "mouse": [x, y], "pressed": true}
+#                                       no reply
+#   {"op": "state"}                     one JSON line: the save snapshot plus "message"
+#   {"op": "frame", "format": "png"}    a JSON line {"width", "height", "format", "bytes"}
+#                                       followed by that many bytes (png or raw RGB)
+# Bad requests get {"error": ...}; positions are clamped to the window. A
+# session whose step fails is closed along with its connection, and the
+# others keep running.
+HOST_ADDRESS = "127.0.0.1"
+HOST_PORT = 7470
+HOST_MAX_LAG = 0.25          # seconds behind before the tick clock gives up catching up
+FRAME_FORMATS = ("png", "raw")
+INPUT_KINDS = ("down", "up", "move")
+
+def input_pos(pos):
+    if not isinstance(pos, (list, tuple)) or len(pos) != 2:
+        raise ValueError("a position must be [x, y]")
+    coords = []
+    for value, limit in zip(pos, (WINDOW_WIDTH, WINDOW_HEIGHT)):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("a position must be two numbers")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError("a position must be two finite numbers")
+        coords.append(int(min(max(value, 0), limit - 1)))
+    return tuple(coords)
+
+def present_nothing(rects):
+    pass  # session surfaces are off-screen; clients fetch frames instead
+
+def encode_frame(surface, fmt):
+    # runs on the host's encoder threads; zlib lets go of the GIL while it compresses
+    if fmt == "raw":
+        return surface_to_bytes(surface, "RGB")
+    return encode_png(surface)
+
+class Session:
+    def __init__(self, session_id, sim, fonts):
+        self.id = session_id
+        self.sim = sim
+        self.fonts = fonts
+        self.pending = Inputs()
+        self.view = None
+        self.frames = 0
+
+    def push_input(self, events=(), mouse_pos=None, pressed=None):
+        # everything is checked before anything is applied
+        checked = []
+        for event in events:
+            if not isinstance(event, (list, tuple)) or len(event) != 2:
+                raise ValueError("an input event must be [kind, [x, y]]")
+            kind, pos = event
+            if kind not in INPUT_KINDS:
+                raise ValueError(f"unknown input event {kind!r}")
+            checked.append((kind, input_pos(pos)))
+        if mouse_pos is not None:
+            mouse_pos = input_pos(mouse_pos)
+        self.pending.events.extend(checked)
+        if mouse_pos is not None:
+            self.pending.mouse_pos = mouse_pos
+        if pressed is not None:
+            self.pending.mouse_pressed = bool(pressed)
+
+    def step(self, dt):
+        sim = self.sim
+        pending = self.pending
+        if not pending.events and not pending.mouse_pressed and sim.idle():
+            sim.skip_idle_ticks(1, dt)
+            return
+        sim.step(dt, pending)
+        sim.drain_events()  # animations and sounds are the client's business
+        self.pending = Inputs(pending.mouse_pos, pending.mouse_pressed)
+
+    def state(self):
+        state = self.sim.snapshot()
+        state["message"] = self.sim.message
+        return state
+
+    def draw(self):
+        if self.view is None:
+            self.view = SceneView(self.sim, pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT)), self.fonts,
+                                  present=present_nothing)
+            self.view.time_source = lambda: int(self.sim.time * 1000)
+        self.view.mouse_pos = self.pending.mouse_pos
+        self.view.render(1.0)
+        self.frames += 1
+        return self.view.screen
+
+    def frame(self, fmt="png"):
+        return encode_frame(self.draw(), fmt)
+
+class SessionHost:
+    def __init__(self, scene=None, dt=SIM_DT):
+        self.scene = scene
+        self.dt = dt
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.fonts = None
+        self.ticks = 0
+        self.writers = {}   # session id -> its connection
+
+    def setup(self):
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        pygame.init()
+        # a tiny hidden display, only so textures can be converted once
+        pygame.display.set_mode((1, 1))
+        if self.scene is None:
+            self.scene = get_scene()
+        self.fonts = default_fonts()
+        ASSETS.use_scene(self.scene)
+        ASSETS.open_bundle()
+        ASSETS.load_now(ASSETS.paths)
+
+    def open_session(self, sim=None):
+        session = Session(next(self.ids), sim if sim is not None else Simulation(self.scene), self.fonts)
+        self.sessions[session.id] = session
+        return session
+
+    def close_session(self, session):
+        self.sessions.pop(session.id, None)
+
+    def tick(self):
+        for session in list(self.sessions.values()):
+            try:
+                session.step(self.dt)
+            except Exception as e:
+                # one broken game mustn't stop everyone else's
+                print(f"Session {session.id} failed, closing it: {e!r}")
+                self.close_session(session)
+                writer = self.writers.get(session.id)
+                if writer is not None:
+                    writer.close()
+        self.ticks += 1
+
+    async def run_ticks(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            self.tick()
+            next_tick += self.dt
+            delay = next_tick - loop.time()
+            if delay < -HOST_MAX_LAG:
+                next_tick = loop.time()
+            await asyncio.sleep(max(0.0, delay))
+
+    async def handle_client(self, reader, writer):
+        session = self.open_session()
+        self.writers[session.id] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    await self.handle_request(session, json.loads(line), writer)
+                except (ValueError, TypeError, KeyError, IndexError) as e:
+                    writer.write(json.dumps({"error": str(e)}).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.pop(session.id, None)
+            self.close_session(session)
+            writer.close()
+
+    async def handle_request(self, session, request, writer):
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        op = request.get("op")
+        if op == "input":
+            session.push_input(request.get("events", ()), request.get("mouse"), request.get("pressed"))
+        elif op == "state":
+            writer.write(json.dumps(session.state(), separators=(",", ":")).encode("utf-8") + b"\n")
+        elif op == "frame":
+            fmt = request.get("format", "png")
+            if fmt not in FRAME_FORMATS:
+                raise ValueError(f"unknown frame format {fmt!r}")
+            # drawing stays on the loop, encoding goes to a worker thread; the
+            # surface is only redrawn by this connection's next request
+            surface = session.draw()
+            data = await asyncio.get_running_loop().run_in_executor(None, encode_frame, surface, fmt)
+            header = {"width": WINDOW_WIDTH, "height": WINDOW_HEIGHT, "format": fmt, "bytes": len(data)}
+            writer.write(json.dumps(header).encode("utf-8") + b"\n")
+            writer.write(data)
+        else:
+            raise ValueError(f"unknown op {op!r}")
+
+    async def serve(self, host=HOST_ADDRESS, port=HOST_PORT):
+        self.setup()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        # SDL turns SIGTERM into a QUIT event that nothing here reads
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, AttributeError):
+            pass  # no signal handlers on Windows event loops
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Session host listening on {host}:{port}")
+        ticks = asyncio.create_task(self.run_ticks())
+
+        def ticks_done(task):
+            if not task.cancelled() and task.exception() is not None:
+                print(f"Session host tick loop failed, shutting down: {task.exception()!r}")
+                stop.set()
+        ticks.add_done_callback(ticks_done)
+        try:
+            await stop.wait()
+        finally:
+            ticks.cancel()
+            server.close()
+            for writer in list(self.writers.values()):
+                writer.close()
+            await server.wait_closed()
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except (NotImplementedError, AttributeError):
+                pass
+        print(f"Session host stopped ({len(self.sessions)} sessions open)")
+
+def run_host_benchmark(counts=(1, 8, 32, 128), seconds=10.0, frame_every=6):
+    # Steps N sessions through the scripted playthrough (restarting each as
+    # it finishes) as fast as possible, drawing a raw frame for each session
+    # every `frame_every` ticks, and reports how many sessions one core
+    # keeps in real time. Sockets are left out; they scale with the client.
+    host = SessionHost()
+    host.setup()
+    _, steps = BENCH_SCENARIOS["playthrough"]
+    ticks = int(seconds / host.dt)
+    print(f"{'sessions':>8s} {'ms/tick':>9s} {'frames':>7s} {'sessions/core':>14s}")
+    results = {}
+    for count in counts:
+        scripts = []
+        for _ in range(count):
+            session = host.open_session()
+            scripts.append([session, script_inputs(session.sim, steps)])
+        frames = 0
+        start = time.process_time()
+        for tick in range(ticks):
+            for i, entry in enumerate(scripts):
+                session, script = entry
+                inputs = next(script, None)
+                if inputs is None:
+                    host.close_session(session)
+                    session = entry[0] = host.open_session()
+                    script = entry[1] = script_inputs(session.sim, steps)
+                    inputs = next(script)
+                session.push_input(inputs.events, inputs.mouse_pos, inputs.mouse_pressed)
+                if frame_every and (tick + i) % frame_every == 0:
+                    session.frame("raw")
+                    frames += 1
+            host.tick()
+        cpu = time.process_time() - start
+        for session, _ in scripts:
+            host.close_session(session)
+        per_core = count * seconds / cpu if cpu > 0 else float("inf")
+        results[count] = per_core
+        print(f"{count:8d} {cpu * 1000.0 / ticks:9.3f} {frames:7d} {per_core:14.1f}")
+    return results
+
+# ---------------- Run ----------------
+def parse_size(text):
+    try:
+        w, h = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if w <= 0 or h <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {text!r}")
+    return w, h
 
-# ---------------- Run ----------------
 if __name__ == "__main__":
-    Game().run()
+    parser = argparse.ArgumentParser(description="Dungeon of Whispers")
+    parser.add_argument("--headless", type=int, metavar="TICKS",
+                        help="step the simulation TICKS times without a window and report the tick rate")
+    parser.add_argument("--asset-report", action="store_true",
+                        help="load every asset and print per-asset load times")
+    parser.add_argument("--profile", action="store_true",
+                        help="show the per-phase frame timing overlay (toggle in game with F3)")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="stream per-frame phase timings to FILE (.csv or .jsonl)")
+    parser.add_argument("--bench", nargs="*", metavar="SCENARIO", choices=sorted(BENCH_SCENARIOS),
+                        help="run the scripted rendering benchmarks headless (default: all scenarios)")
+    parser.add_argument("--bench-save", metavar="FILE", help="write benchmark results as JSON")
+    parser.add_argument("--bench-baseline", metavar="FILE", help="fail if p95 frame CPU times regress against FILE")
+    parser.add_argument("--bench-tolerance", type=float, default=BENCH_TOLERANCE,
+                        help=f"allowed p95 slowdown against the baseline (default {BENCH_TOLERANCE:g})")
+    parser.add_argument("--bench-repeats", type=int, default=BENCH_REPEATS, metavar="N",
+                        help=f"time each scenario N times and compare medians (default {BENCH_REPEATS})")
+    parser.add_argument("--record", metavar="FILE", help="record mouse and quit input to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="play back an input recording")
+    parser.add_argument("--fast", action="store_true", help="with --replay: run as fast as possible")
+    parser.add_argument("--no-render", action="store_true", help="with --replay --fast: simulate only, no window")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="capture frames for QA: a directory gets a PNG sequence, a .raw file raw video")
+    parser.add_argument("--capture-buffers", type=int, default=CAPTURE_BUFFERS, metavar="N",
+                        help=f"frames that may wait for the encoder before new ones are dropped (default {CAPTURE_BUFFERS})")
+    parser.add_argument("--pixel-hits", action="store_true",
+                        help="only count clicks on opaque texture pixels")
+    parser.add_argument("--transition", choices=TRANSITION_EFFECTS, default=TRANSITION_EFFECT,
+                        help="room transition effect (default: fade)")
+    parser.add_argument("--no-idle", action="store_true",
+                        help="keep drawing at full frame rate even when nothing on screen changes")
+    parser.add_argument("--frame-budget", type=float, metavar="MS",
+                        help="frame time above which non-essential work is skipped (default: one 60 FPS frame)")
+    parser.add_argument("--render-size", type=parse_size, metavar="WxH",
+                        help="internal resolution frames are drawn at (default: 1024x768)")
+    parser.add_argument("--window-size", type=parse_size, metavar="WxH",
+                        help="window size; frames are scaled to it once at the end (default: 1024x768)")
+    parser.add_argument("--fullscreen", action="store_true", help="scale frames to the whole screen")
+    parser.add_argument("--smooth-scale", action="store_true",
+                        help="filter the final upscale instead of using nearest pixels")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="print the memory ledger (textures, scaled copies, caches, sounds) for every room")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="cap textures plus their scaled copies; other rooms' textures are evicted first")
+    parser.add_argument("--lighting", action="store_true",
+                        help="light rooms with flickering torches, a vignette and a cursor lamp (needs NumPy)")
+    parser.add_argument("--load", nargs="?", const=SAVE_PATH, metavar="FILE",
+                        help="continue from a save game (default: the autosave)")
+    parser.add_argument("--save", default=SAVE_PATH, metavar="FILE",
+                        help="where autosaves and F5 saves go (default: savegame.dat)")
+    parser.add_argument("--no-autosave", action="store_true", help="don't write save games")
+    parser.add_argument("--explore", nargs="?", const=0, type=int, metavar="WORKERS",
+                        help="search every reachable puzzle state and check the goals in rooms.json "
+                             "(default: one worker per core)")
+    parser.add_argument("--host", nargs="?", const=HOST_PORT, type=int, metavar="PORT",
+                        help=f"run headless game sessions for local socket clients (default port {HOST_PORT})")
+    parser.add_argument("--host-bench", nargs="*", type=int, metavar="N",
+                        help="benchmark N concurrent host sessions and report sessions per core")
+    parser.add_argument("--bake", action="store_true",
+                        help="write the pre-scaled texture bundle used for fast startup")
+    args = parser.parse_args()
+    if args.load and (args.record or args.replay):
+        parser.error("recordings always start from a new game; --load can't be combined with --record/--replay")
+    if args.capture and args.no_render:
+        parser.error("--capture needs frames; it can't be combined with --no-render")
+    PIXEL_PERFECT_HITS = args.pixel_hits
+    TRANSITION_EFFECT = args.transition
+    IDLE_SLEEP = not args.no_idle
+    if args.frame_budget:
+        FRAME_BUDGET_MS = args.frame_budget
+    if args.render_size:
+        RENDER_SIZE = args.render_size
+    if args.window_size:
+        DISPLAY_SIZE = args.window_size
+    FULLSCREEN = args.fullscreen
+    SMOOTH_UPSCALE = args.smooth_scale
+    LIGHTING = args.lighting
+    if args.memory_budget:
+        ASSETS.budget = int(args.memory_budget * 1024 * 1024)
+    if args.headless:
+        run_headless(args.headless)
+    elif args.asset_report:
+        pygame.init()
+        ASSETS.open_bundle()
+        ASSETS.load_now(ASSET_PATHS)
+        print(ASSETS.report())
+    elif args.memory_report:
+        run_memory_report()
+    elif args.bench is not None:
+        ok = run_benchmarks(args.bench, args.bench_baseline, args.bench_save, args.bench_tolerance,
+                            args.bench_repeats)
+        sys.exit(0 if ok else 1)
+    elif args.explore is not None:
+        sys.exit(0 if run_explorer(args.explore) else 1)
+    elif args.host is not None:
+        try:
+            asyncio.run(SessionHost().serve(port=args.host))
+        except KeyboardInterrupt:
+            pass
+    elif args.host_bench is not None:
+        run_host_benchmark(args.host_bench or (1, 8, 32, 128))
+    elif args.bake:
+        pygame.init()
+        path = bundle_path(RENDER_SIZE)
+        index = bake_assets(path, render_asset_sizes(RENDER_SIZE))
+        print(f"Baked {len(index)} assets into {path}")
+    elif args.replay and args.fast:
+        capture = FrameCapture(args.capture, args.capture_buffers) if args.capture else None
+        replay_fast(args.replay, render=not args.no_render, capture=capture)
+    else:
+        profiler = None
+        if args.profile or args.profile_out:
+            profiler = FrameProfiler(hud=args.profile, out_path=args.profile_out)
+        recorder = InputRecorder(args.record) if args.record else None
+        replay = InputReplay(args.replay) if args.replay else None
+        try:
+            sim = load_save(args.load) if args.load else None
+        except (OSError, ValueError) as e:
+            parser.error(f"can't load {args.load}: {e}")
+        save_path = None if args.no_autosave or replay else args.save
+        capture = FrameCapture(args.capture, args.capture_buffers) if args.capture else None
+        game = Game(sim=sim, profiler=profiler, recorder=recorder, replay=replay, save_path=save_path,
+                    capture=capture)
+        if replay:
+            game.time_source = lambda: int(game.sim.time * 1000)
+        game.run()
  